@@ -0,0 +1,85 @@
+import hashlib
+import json
+import time
+
+from mpds_client.errors import APIError
+
+from ab_initio_calculations.utils.disk_cache import DiskLRUCache
+
+
+class QueryCache(DiskLRUCache):
+    """On-disk cache of raw MPDS get_data responses.
+    Entries are JSON files named by the hash of the normalized query,
+    evicted in the least recently used order, see DiskLRUCache.
+    """
+
+    suffix = ".json"
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: float = 7 * 24 * 3600,
+        max_bytes: int = 512 * 1024 * 1024,
+        offline: bool = False,
+    ):
+        """
+        Args:
+            cache_dir: Folder to keep the cached responses in
+            ttl: Seconds after which an entry is considered stale
+            max_bytes: Size limit of the cache folder
+            offline: Serve stale entries and never hit the network
+        """
+        super().__init__(cache_dir, max_bytes)
+        self.ttl = ttl
+        self.offline = offline
+
+    @staticmethod
+    def get_key(query: dict, fields: dict = None, dtype: int = None) -> str:
+        """Hash of the query, insensitive to the order of keys"""
+        normalized = json.dumps(
+            {"query": query, "fields": fields, "dtype": dtype},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Return cached response or None if missing or expired"""
+        content = self.read(key)
+        if content is None:
+            return None
+        try:
+            entry = json.loads(content)
+        except json.JSONDecodeError:
+            # truncated by an interrupted write of older versions or a full disk
+            return None
+        if not self.offline and time.time() - entry["created"] > self.ttl:
+            return None
+        self.touch(key)
+        return entry["response"]
+
+    def put(self, key: str, query: dict, fields: dict, response: list):
+        self.write(
+            key,
+            json.dumps(
+                {
+                    "query": query,
+                    "fields": fields,
+                    "created": time.time(),
+                    "response": response,
+                }
+            ),
+        )
+
+    def get_data(self, client, query: dict, fields: dict = None) -> list:
+        """Cached counterpart of MPDSDataRetrieval.get_data"""
+        key = self.get_key(query, fields, client.dtype)
+        response = self.get(key)
+        if response is not None:
+            return response
+        if self.offline:
+            raise APIError(f"No cached response for {query} in offline mode", 204)
+
+        response = client.get_data(query, fields=fields)
+        self.put(key, query, fields, response)
+        return response
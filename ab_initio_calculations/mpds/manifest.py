@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import time
+
+
+def get_file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArchiveManifest:
+    """Append-only JSONL record of the archives already synced, keyed by URL.
+    The last record of a URL wins; a line cut by an interrupted run is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[record["url"]] = record
+
+    def get(self, url: str) -> dict:
+        return self.entries.get(url)
+
+    def is_synced(self, url: str) -> bool:
+        """The archive is recorded and its local copy is complete"""
+        record = self.entries.get(url)
+        if not record:
+            return False
+        return (
+            os.path.exists(record["path"])
+            and os.path.getsize(record["path"]) == record["size"]
+        )
+
+    def get_conditional_headers(self, url: str) -> dict:
+        """Headers asking the server to answer 304 if the archive did not change"""
+        record = self.entries.get(url) or {}
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def add(
+        self,
+        url: str,
+        path: str,
+        classification: bool,
+        etag: str = None,
+        last_modified: str = None,
+    ) -> dict:
+        previous = self.entries.get(url)
+        if previous and previous["path"] != path and os.path.exists(previous["path"]):
+            # archive changed its classification, drop the stale copy
+            os.remove(previous["path"])
+
+        record = {
+            "url": url,
+            "path": path,
+            "size": os.path.getsize(path),
+            "sha256": get_file_checksum(path),
+            "classification": classification,
+            "etag": etag,
+            "last_modified": last_modified,
+            "timestamp": time.time(),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.entries[url] = record
+        return record
+
+    def compact(self):
+        """Rewrite the manifest keeping only the latest record per URL"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
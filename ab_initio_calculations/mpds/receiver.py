@@ -1,19 +1,160 @@
 import io
 import os
 import shutil
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
+from urllib.parse import urlparse
 
 import py7zr
 import requests
+import requests.adapters
 from mpds_client import MPDSDataRetrieval, MPDSDataTypes
+from ab_initio_calculations.mpds.cache import QueryCache
+from ab_initio_calculations.mpds.manifest import ArchiveManifest
 from ab_initio_calculations.mpds.utils import get_props_folders_map
 from mpds_client.errors import APIError
 from ase import Atoms
+from ab_initio_calculations.settings import Settings
+from ab_initio_calculations.utils.structure_processor import (
+    get_site_key,
+    select_candidate_rows,
+)
+from ab_initio_calculations.utils.structure_record import StructureRecord
 
 
-def download_and_process_archives(arch_dir = "./mpds_archives/"):
-    """Downloads MPDS archives, extracts and validates them."""
+class HostLimiter:
+    """Caps the number of simultaneous requests sent to a single host"""
+
+    def __init__(self, per_host: int = 4):
+        self.per_host = per_host
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[host]
+
+
+def get_session(pool_size: int = 8) -> requests.Session:
+    """Keep-alive session with a connection pool large enough for all workers"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def part_path(arch_dir: str, prop: str, archive_url: str) -> str:
+    """Temporary location of an archive being streamed to disk"""
+    return arch_dir + prop + "/" + os.path.basename(archive_url) + ".part"
+
+
+def archive_target(arch_dir: str, prop: str, archive_url: str, is_valid: bool) -> str:
+    """Final location of a classified archive"""
+    return (
+        arch_dir + prop + ("/true/" if is_valid else "/false/") + os.path.basename(archive_url)
+    )
+
+
+def save_archive(content: bytes, arch_dir: str, prop: str, archive_url: str) -> bool:
+    """Extract the archive, check the expected folder and keep it under true/ or false/"""
+    curr_folder = arch_dir + prop + "/" + os.path.basename(archive_url)[:-3]
+    with py7zr.SevenZipFile(io.BytesIO(content), mode="r") as archive:
+        archive.extractall(path=curr_folder)
+    print(f"The archive {archive_url} is opening successfully")
+
+    is_valid = os.path.exists(curr_folder + "/" + get_props_folders_map()[prop])
+    shutil.rmtree(curr_folder)
+
+    target = archive_target(arch_dir, prop, archive_url, is_valid)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + ".part", "wb") as f:
+        f.write(content)
+    os.replace(target + ".part", target)
+    return is_valid
+
+
+def archive_has_folder(archive_path: str, folder: str) -> bool:
+    """Check the 7z directory listing for the folder, without decompressing the members"""
+    with py7zr.SevenZipFile(archive_path, mode="r") as archive:
+        names = [os.path.normpath(name).replace(os.sep, "/") for name in archive.getnames()]
+    folder = folder.strip("/")
+    return any(name == folder or name.startswith(folder + "/") for name in names)
+
+
+def place_archive(part_path: str, arch_dir: str, prop: str, archive_url: str) -> bool:
+    """Classify the downloaded archive by its listing and move it under true/ or false/"""
+    is_valid = archive_has_folder(part_path, get_props_folders_map()[prop])
+    print(f"The archive {archive_url} is opening successfully")
+
+    target = archive_target(arch_dir, prop, archive_url, is_valid)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(part_path, target)
+    return is_valid
+
+
+def fetch_archive(
+    session: requests.Session,
+    archive_url: str,
+    limiter: HostLimiter,
+    stop: threading.Event,
+    timeout: float = 120,
+    part_path: str = None,
+    chunk_size: int = 1 << 20,
+    headers: dict = None,
+):
+    """Download a single archive, respecting the per-host limit.
+    With part_path given, the body is streamed in chunks to that file
+    instead of being kept in memory.
+    """
+    if stop.is_set():
+        return None
+    with limiter.slot(archive_url):
+        if part_path is None:
+            return session.get(archive_url, timeout=timeout, headers=headers)
+
+        with session.get(
+            archive_url, timeout=timeout, headers=headers, stream=True
+        ) as response:
+            if response.status_code == 200:
+                os.makedirs(os.path.dirname(part_path), exist_ok=True)
+                with open(part_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            return response
+
+
+def download_and_process_archives(
+    arch_dir="./mpds_archives/",
+    max_workers: int = 8,
+    per_host: int = 4,
+    stream: bool = False,
+    resume: bool = True,
+    revalidate: bool = False,
+):
+    """Downloads MPDS archives, extracts and validates them.
+
+    Args:
+        arch_dir: Folder to keep the archives in, split by property and validity
+        max_workers: Number of concurrent downloads
+        per_host: Maximal number of concurrent downloads from the same host
+        stream: Write archives to disk chunk by chunk and classify them by
+            the 7z listing, so that no archive is held in memory or extracted
+        resume: Skip archives already recorded in the property manifest
+            and present on disk
+        revalidate: Re-request the recorded archives conditionally
+            (ETag / Last-Modified) and fetch only those changed on the server
+    """
     mpds_api = MPDSDataRetrieval(dtype=MPDSDataTypes.AB_INITIO)
+    session = get_session(max_workers)
+    limiter = HostLimiter(per_host)
     result_count = {}
 
     for prop in get_props_folders_map().keys():
@@ -26,41 +167,93 @@ def download_and_process_archives(arch_dir = "./mpds_archives/"):
             continue
 
         try:
+            # one manifest per property, as an archive may serve several properties
+            manifest = ArchiveManifest(arch_dir + prop + "/manifest.jsonl") if resume else None
+            urls = []
             for entry in entries:
-                archive_url = entry["sample"]["measurement"][0]["raw_data"]
-
-                response = requests.get(archive_url)
-                if response.status_code == 200:
-                    curr_folder = arch_dir + prop + "/" + os.path.basename(archive_url)[:-3]
-                    with py7zr.SevenZipFile(
-                        io.BytesIO(response.content), mode="r"
-                    ) as archive:
-                        archive.extractall(path=curr_folder)
-                    print(f"The archive {archive_url} is opening successfully")
-
-                    if os.path.exists(curr_folder + "/" + get_props_folders_map()[prop]):
-                        cnt += 1
-                        shutil.rmtree(curr_folder)
-                        os.makedirs(arch_dir + prop + "/true/", exist_ok=True)
-                        with open(
-                            arch_dir + prop + "/true/" + os.path.basename(archive_url), "wb"
-                        ) as f:
-                            f.write(response.content)
+                url = entry["sample"]["measurement"][0]["raw_data"]
+                if manifest and manifest.is_synced(url) and not revalidate:
+                    cnt += int(manifest.get(url)["classification"])
+                    continue
+                urls.append(url)
+            if len(urls) < len(entries):
+                print(f"[{prop}] {len(entries) - len(urls)} archives already synced")
+
+            stop = threading.Event()
+            n_done, n_bytes, started = 0, 0, time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        fetch_archive,
+                        session,
+                        url,
+                        limiter,
+                        stop,
+                        part_path=part_path(arch_dir, prop, url) if stream else None,
+                        headers=(
+                            manifest.get_conditional_headers(url)
+                            if manifest and manifest.is_synced(url)
+                            else None
+                        ),
+                    ): url
+                    for url in urls
+                }
+                for future in as_completed(futures):
+                    # release the finished futures, each holds its whole archive
+                    # unless streaming, so that only the one being saved stays in memory
+                    archive_url = futures.pop(future)
+                    n_done += 1
+                    try:
+                        response = future.result()
+                    except requests.RequestException as e:
+                        print(f"Failed to load archive {archive_url}: {e}")
+                        continue
+                    finally:
+                        del future
+                    if response is None:
+                        continue
+
+                    if response.status_code == 200:
+                        etag = response.headers.get("ETag")
+                        last_modified = response.headers.get("Last-Modified")
+                        if stream:
+                            part = part_path(arch_dir, prop, archive_url)
+                            n_bytes += os.path.getsize(part)
+                            is_valid = place_archive(part, arch_dir, prop, archive_url)
+                        else:
+                            n_bytes += len(response.content)
+                            is_valid = save_archive(
+                                response.content, arch_dir, prop, archive_url
+                            )
+                        response = None
+                        cnt += int(is_valid)
+                        if manifest:
+                            manifest.add(
+                                archive_url,
+                                archive_target(arch_dir, prop, archive_url, is_valid),
+                                is_valid,
+                                etag=etag,
+                                last_modified=last_modified,
+                            )
+
+                    elif response.status_code == 304:
+                        cnt += int(manifest.get(archive_url)["classification"])
+
+                    elif response.status_code == 400:
+                        stop.set()
                     else:
-                        shutil.rmtree(curr_folder)
-                        os.makedirs(arch_dir + prop + "/false/", exist_ok=True)
-                        with open(
-                            arch_dir + prop + "/false/" + os.path.basename(archive_url),
-                            "wb",
-                        ) as f:
-                            f.write(response.content)
-
-                elif response.status_code == 400:
-                    break
-                else:
-                    print(
-                        f"Failed to load archive {archive_url}. Status:{response.status_code}"
-                    )
+                        print(
+                            f"Failed to load archive {archive_url}. Status:{response.status_code}"
+                        )
+
+                    if n_done % 50 == 0 or n_done == len(urls):
+                        elapsed = time.perf_counter() - started
+                        print(
+                            f"[{prop}] {n_done}/{len(urls)} archives, "
+                            f"{n_bytes / 1e6:.1f} MB, {n_bytes / 1e6 / elapsed:.2f} MB/s"
+                        )
+
             result_count[prop] = {"n_mpds_api": len(entries), "n_real": cnt}
             print("Result for current iteration: ", result_count[prop])
         except Exception as e:
@@ -69,36 +262,172 @@ def download_and_process_archives(arch_dir = "./mpds_archives/"):
     print("Result: ", result_count)
     
 
-def download_structures(el: str = None, query_dict: dict = None) -> tuple[list[Atoms], list[list], str]:
+STRUCT_FIELDS = {
+    "S": [
+        "entry",
+        "occs_noneq",
+        "cell_abc",
+        "sg_n",
+        "basis_noneq",
+        "els_noneq",
+    ]
+}
+
+
+def get_element_query(el: str = None) -> dict:
+    """Query for the cubic unary structures of the element, or of all elements"""
+    query = {
+        "props": "atomic structure",
+        "classes": "unary",
+        "lattices": "cubic",
+    }
+    if el:
+        query = {"elements": el, **query}
+    return query
+
+
+def compile_chunk(rows: list[list], compact: bool = False) -> list[Atoms]:
+    """Build structures for a chunk of raw rows, None for the rows without structure"""
+    structs = [MPDSDataRetrieval.compile_crystal(line[2:], flavor="ase") for line in rows]
+    if compact:
+        return [
+            StructureRecord.from_atoms(struct, entry=line[0], sg=int(line[3])) if struct else None
+            for struct, line in zip(structs, rows)
+        ]
+    return structs
+
+
+def compile_rows(
+    rows: list[list], workers: int = None, chunksize: int = 64, compact: bool = False
+) -> list[Atoms]:
+    """Build structures for the raw rows, in a process pool if workers > 1.
+    The result always follows the order of the rows.
+    """
+    if not workers or workers < 2 or len(rows) <= chunksize:
+        return compile_chunk(rows, compact)
+
+    chunks = [rows[i : i + chunksize] for i in range(0, len(rows), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [
+            struct
+            for chunk in executor.map(partial(compile_chunk, compact=compact), chunks)
+            for struct in chunk
+        ]
+
+
+def compile_structures(
+    response: list[list], prefilter: bool = False, workers: int = None, compact: bool = False
+) -> tuple[list[Atoms], list[list]]:
+    """Build ASE structures from the raw rows requested with STRUCT_FIELDS
+
+    Args:
+        response: Raw response data from MPDS
+        prefilter: Build only the rows process_structures may select,
+            see select_candidate_rows
+        workers: Number of processes to build the structures in
+        compact: Return StructureRecord instead of ase.Atoms
+
+    Returns:
+        tuple: (list of ASE Atoms structures, raw rows they correspond to)
+    """
+    if not prefilter:
+        structs = compile_rows(response, workers, compact=compact)
+        return list(filter(None, structs)), response
+
+    # one representative per site key is enough to count the sites
+    representatives = {}
+    for line in response:
+        if line and line[-1]:
+            representatives.setdefault(get_site_key(line), line)
+    # built structures are reused, keyed by row identity
+    compiled = {
+        id(line): struct
+        for line, struct in zip(
+            representatives.values(),
+            compile_rows(list(representatives.values()), workers, compact=compact),
+        )
+    }
+    n_sites = {
+        key: len(compiled[id(line)]) if compiled[id(line)] else float("inf")
+        for key, line in representatives.items()
+    }
+
+    selected = [
+        response[idx]
+        for idx in select_candidate_rows(response, lambda line: n_sites[get_site_key(line)])
+    ]
+    missing = [line for line in selected if id(line) not in compiled]
+    compiled.update(
+        {
+            id(line): struct
+            for line, struct in zip(missing, compile_rows(missing, workers, compact=compact))
+        }
+    )
+
+    structs, rows = [], []
+    for line in selected:
+        if compiled[id(line)]:
+            structs.append(compiled[id(line)])
+            rows.append(line)
+    return structs, rows
+
+
+def get_default_cache():
+    """Query cache configured in conf.ini, if any"""
+    try:
+        settings = Settings()
+    except FileNotFoundError:
+        return None
+    if not settings.mpds_cache_dir:
+        return None
+    return QueryCache(
+        settings.mpds_cache_dir,
+        ttl=settings.mpds_cache_ttl,
+        max_bytes=settings.mpds_cache_max_mb * 1024 * 1024,
+        offline=settings.mpds_offline,
+    )
+
+
+def get_data(client: MPDSDataRetrieval, query: dict, fields: dict, cache: QueryCache = None) -> list:
+    """Request MPDS, going through the query cache when available"""
+    if cache is None:
+        return client.get_data(query, fields=fields)
+    return cache.get_data(client, query, fields)
+
+
+def download_structures(
+    el: str = None,
+    query_dict: dict = None,
+    cache: QueryCache = None,
+    prefilter: bool = False,
+    workers: int = None,
+    compact: bool = False,
+) -> tuple[list[Atoms], list[list], str]:
     """Request structures from MPDS and return raw data
     
     Args:
         el: Element symbol (optional)
         query_dict: Custom query dictionary (optional)
+        cache: Query cache to use instead of the one from conf.ini (optional)
+        prefilter: Build only the structures process_structures may select;
+            the raw response is then reduced to the matching rows (optional)
+        workers: Number of processes to build the structures in (optional)
+        compact: Return StructureRecord instead of ase.Atoms (optional)
         
     Returns:
         tuple: (list of ASE Atoms structures, raw response data, element symbol)
     """
     client = MPDSDataRetrieval(dtype=MPDSDataTypes.ALL)
+    cache = cache or get_default_cache()
     
     if not el:
-        from utils import get_random_element  # here to avoid circular import issues
+        # here to avoid circular import issues
+        from ab_initio_calculations.mpds.utils import get_random_element
         el = get_random_element()
     if query_dict:
         try:
-            response = client.get_data(query_dict, fields={
-                "S": [
-                    "entry",
-                    "occs_noneq",
-                    "cell_abc",
-                    "sg_n",
-                    "basis_noneq",
-                    "els_noneq",
-                ]
-            })
-            
-            structs = [client.compile_crystal(line[2:], flavor="ase") for line in response]
-            structs = list(filter(None, structs))
+            response = get_data(client, query_dict, STRUCT_FIELDS, cache)
+            structs, response = compile_structures(response, prefilter, workers, compact)
             
             return structs, response, el
         except APIError as e:
@@ -106,27 +435,8 @@ def download_structures(el: str = None, query_dict: dict = None) -> tuple[list[A
             return None, None, el
     
     try:
-        response = client.get_data(
-            {
-                "elements": el,
-                "props": "atomic structure",
-                "classes": "unary",
-                "lattices": "cubic",
-            },
-            fields={
-                "S": [
-                    "entry",
-                    "occs_noneq",
-                    "cell_abc",
-                    "sg_n",
-                    "basis_noneq",
-                    "els_noneq",
-                ]
-            },
-        )
-        
-        structs = [client.compile_crystal(line[2:], flavor="ase") for line in response]
-        structs = list(filter(None, structs))
+        response = get_data(client, get_element_query(el), STRUCT_FIELDS, cache)
+        structs, response = compile_structures(response, prefilter, workers, compact)
         
         return structs, response, el
         
@@ -135,6 +445,100 @@ def download_structures(el: str = None, query_dict: dict = None) -> tuple[list[A
         return None, None, el
     
     
+def split_response(response: list[list], keys: list) -> dict:
+    """Distribute the rows of a combined response over the requested keys:
+    element symbols are matched against els_noneq, (formula, sg) pairs against sg_n
+    """
+    grouped = {key: [] for key in keys}
+    by_sg = {int(key[1]): key for key in keys if isinstance(key, tuple)}
+    for line in response:
+        if not line or not line[-1]:
+            continue
+        els = set(line[-1])
+        if len(els) == 1 and tuple(els)[0] in grouped:
+            grouped[tuple(els)[0]].append(line)
+        elif int(line[3]) in by_sg:
+            grouped[by_sg[int(line[3])]].append(line)
+    return grouped
+
+
+def download_structures_batch(
+    keys: list,
+    cache: QueryCache = None,
+    prefilter: bool = False,
+    workers: int = None,
+    compact: bool = False,
+) -> list[tuple[list[Atoms], list[list], str]]:
+    """Request structures for many elements or (formula, sg) pairs
+    with as few MPDS queries as possible.
+
+    All elements are served by a single query for the cubic unaries, split
+    by els_noneq. The pairs are grouped by formula, one query per formula,
+    and split by sg_n. Should a combined query fail, the keys fall back to
+    one request each.
+
+    Args:
+        keys: Element symbols and / or (formula, sg) pairs
+        cache: Query cache to use instead of the one from conf.ini (optional)
+        prefilter: Build only the structures process_structures may select (optional)
+        workers: Number of processes to build the structures in (optional)
+        compact: Return StructureRecord instead of ase.Atoms (optional)
+
+    Returns:
+        list: (structures, raw response data, key) per key in the given order,
+            with (None, None, key) where nothing was found
+    """
+    client = MPDSDataRetrieval(dtype=MPDSDataTypes.ALL)
+    cache = cache or get_default_cache()
+
+    elements = [key for key in keys if not isinstance(key, tuple)]
+    by_formula = {}
+    for key in keys:
+        if isinstance(key, tuple):
+            by_formula.setdefault(key[0], []).append(key)
+
+    queries = []
+    if elements:
+        queries.append(
+            (get_element_query(elements[0] if len(elements) == 1 else None), elements)
+        )
+    for formula, pairs in by_formula.items():
+        query = {"formulae": formula, "props": "atomic structure"}
+        if len(pairs) == 1:
+            query["sgs"] = int(pairs[0][1])
+        queries.append((query, pairs))
+
+    grouped = {}
+    for query, group_keys in queries:
+        try:
+            response = get_data(client, query, STRUCT_FIELDS, cache)
+        except APIError as e:
+            if e.code == 204:
+                continue
+            print(f"[WARNING] Combined MPDS query {query} failed, querying one by one: {e}")
+            for key in group_keys:
+                single_query = (
+                    {"formulae": key[0], "sgs": int(key[1]), "props": "atomic structure"}
+                    if isinstance(key, tuple)
+                    else get_element_query(key)
+                )
+                try:
+                    grouped[key] = get_data(client, single_query, STRUCT_FIELDS, cache)
+                except APIError as e:
+                    print(f"[ERROR] MPDS API error for {key}: {e}")
+            continue
+        grouped.update(split_response(response, group_keys))
+
+    result = []
+    for key in keys:
+        response = grouped.get(key)
+        if not response:
+            result.append((None, None, key))
+            continue
+        result.append((*compile_structures(response, prefilter, workers, compact), key))
+    return result
+
+
 if __name__ == "__main__":
     # example
     download_and_process_archives(arch_dir="./mpds_archives/")
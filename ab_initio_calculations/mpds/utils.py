@@ -3,9 +3,7 @@ from math import log
 import numpy as np
 import requests
 
-import os
-import random
-from ab_initio_calculations.settings import Settings
+from ab_initio_calculations.utils.basis_registry import get_basis_registry
 
 
 ab_props_mapping = {
@@ -149,16 +147,6 @@ def ase_to_optimade(ase_obj, name_id=None):
     return dict(data=[result])
 
 
-def get_random_element() -> list:
+def get_random_element() -> str:
     """Return random chemical element for which there exists a basis"""
-    settings = Settings()
-    
-    dir = settings.basis_sets_dir
-
-    files = [
-        f.replace(".basis", "")
-        for f in os.listdir(
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), dir)
-        )
-    ]
-    return random.choice(files)
\ No newline at end of file
+    return get_basis_registry().random_element()
@@ -14,3 +14,15 @@ class Settings:
 
         self.basis_sets_dir = self.config.get("paths", "basis_sets_dir")
         self.pcrystal_input_dir = self.config.get("paths", "pcrystal_input_dir")
+        self.structure_index = self.config.get("paths", "structure_index", fallback="") or None
+        self.error_index = self.config.get("paths", "error_index", fallback="") or None
+        self.basis_cache_dir = self.config.get("paths", "basis_cache_dir", fallback="") or None
+        self.basis_store_dir = self.config.get("paths", "basis_store_dir", fallback="") or None
+
+        self.mpds_cache_dir = self.config.get("mpds", "cache_dir", fallback="") or None
+        self.mpds_cache_ttl = self.config.getfloat("mpds", "cache_ttl", fallback=604800)
+        self.mpds_cache_max_mb = self.config.getint("mpds", "cache_max_mb", fallback=512)
+        self.mpds_offline = self.config.getboolean("mpds", "offline", fallback=False)
+
+        self.inpgen_cache_dir = self.config.get("fleur", "inpgen_cache_dir", fallback="") or None
+        self.inpgen_cache_max_mb = self.config.getint("fleur", "inpgen_cache_max_mb", fallback=256)
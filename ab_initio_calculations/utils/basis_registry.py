@@ -0,0 +1,120 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+from ase.data import chemical_symbols
+
+from ab_initio_calculations.settings import Settings
+
+basis_info = namedtuple("basis_info", field_names="element, path, all_electron, checksum")
+verbatim_basis = namedtuple("basis", field_names="content, all_electron")
+
+
+def get_basis_info(path: str) -> basis_info:
+    """
+    Read the metadata of a single CRYSTAL basis set file;
+    the header is "Z NSHL", where Z > 200 marks an effective core potential
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+
+    element = os.path.basename(path).split(".")[0]
+    header = content.split(None, 1)
+    all_electron = not (header and header[0].isdigit() and int(header[0]) > 200)
+
+    return basis_info(
+        element=element,
+        path=path,
+        all_electron=all_electron,
+        checksum=hashlib.sha256(content).hexdigest(),
+    )
+
+
+class BasisRegistry:
+    """
+    Available basis sets of a folder, element -> basis_info.
+    The folder is listed at most once per check_interval seconds;
+    a file is read and hashed again only when its mtime or size changes
+    """
+
+    def __init__(self, basis_dir: str, check_interval: float = 1.0):
+        self.basis_dir = os.path.abspath(basis_dir)
+        self.check_interval = check_interval
+        self._entries = {}
+        self._elements = []
+        self._stamps = {}
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _scan(self, force: bool = False):
+        entries, stamps = {}, {}
+        old = {info.path: info for info in self._entries.values()}
+        for item in os.scandir(self.basis_dir):
+            if not item.name.endswith(".basis"):
+                continue
+            stat = item.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if not force and item.path in old and self._stamps.get(item.path) == stamp:
+                info = old[item.path]
+            else:
+                info = get_basis_info(item.path)
+            assert info.element in chemical_symbols, "Unexpected basis set file %s" % item.path
+            entries[info.element] = info
+            stamps[item.path] = stamp
+
+        if entries != self._entries:
+            self._entries = entries
+            self._elements = sorted(entries, key=chemical_symbols.index)
+        self._stamps = stamps
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.check_interval:
+            return
+
+        with self._lock:
+            assert os.path.exists(self.basis_dir), (
+                "No folder %s with the basis sets found" % self.basis_dir
+            )
+            self._scan(force)
+            self._checked = now
+
+    def elements(self) -> list:
+        """Elements with a basis set, in the order of atomic numbers"""
+        self.refresh()
+        return list(self._elements)
+
+    def get(self, el: str) -> basis_info:
+        self.refresh()
+        return self._entries.get(el)
+
+    def random_element(self) -> str:
+        self.refresh()
+        return random.choice(self._elements)
+
+    def __contains__(self, el: str) -> bool:
+        self.refresh()
+        return el in self._entries
+
+    def __len__(self):
+        self.refresh()
+        return len(self._entries)
+
+
+_registries = {}
+
+
+def get_basis_registry(basis_dir: str = None) -> BasisRegistry:
+    """Shared registry of the folder, by default the one from conf.ini"""
+    if basis_dir is None:
+        if None not in _registries:
+            _registries[None] = get_basis_registry(Settings().basis_sets_dir)
+        return _registries[None]
+
+    basis_dir = os.path.abspath(basis_dir)
+    if basis_dir not in _registries:
+        _registries[basis_dir] = BasisRegistry(basis_dir)
+    return _registries[basis_dir]
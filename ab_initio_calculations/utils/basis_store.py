@@ -0,0 +1,209 @@
+"""
+Compiled basis set family: a folder of .npy arrays, loaded without
+any parsing and memory-mapped, so that the worker processes share
+one copy of the basis library.
+
+Build it with
+    python -m ab_initio_calculations.utils.basis_store [basis_sets_dir] [store_dir]
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+from ab_initio_calculations.utils.basis_registry import get_basis_registry, verbatim_basis
+
+# CRYSTAL shell types (LAT)
+SHELL_TYPES = ("S", "SP", "P", "D", "F", "G")
+
+ELEMENT_DTYPE = np.dtype(
+    [
+        ("element", "U3"),
+        ("header_z", "i4"),
+        ("all_electron", "?"),
+        ("checksum", "S64"),
+        ("content_start", "i8"),
+        ("content_end", "i8"),
+        ("shell_start", "i8"),
+        ("shell_end", "i8"),
+    ]
+)
+SHELL_DTYPE = np.dtype(
+    [
+        ("ityb", "i4"),
+        ("lat", "i4"),
+        ("ng", "i4"),
+        ("che", "f8"),
+        ("scal", "f8"),
+        ("prim_start", "i8"),
+        ("prim_end", "i8"),
+    ]
+)
+# exponent, coefficient, P coefficient of the SP shells
+PRIMITIVE_COLUMNS = 3
+
+
+def get_store_meta(store_dir: str) -> dict:
+    """Source folder and the checksums of its files at the compilation, None if not built"""
+    try:
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_store_source(store_dir: str) -> str:
+    """Basis set folder the store was compiled from, None if not built"""
+    return (get_store_meta(store_dir) or {}).get("source")
+
+
+def is_store_current(store_dir: str, repo_dir: str) -> bool:
+    """Whether the store was compiled from repo_dir as it is now, same files with the same checksums"""
+    meta = get_store_meta(store_dir)
+    if not meta or meta.get("source") != os.path.abspath(repo_dir):
+        return False
+    registry = get_basis_registry(repo_dir)
+    return meta.get("checksums") == {el: registry.get(el).checksum for el in registry.elements()}
+
+
+class BasisStore(Mapping):
+    """
+    Compiled basis set family, element -> verbatim_basis,
+    the shells and primitives are available as arrays
+    """
+
+    def __init__(self, store_dir: str, mmap: bool = True):
+        mmap_mode = "r" if mmap else None
+        self.store_dir = store_dir
+        self.family = os.path.abspath(store_dir)
+        self.elements = np.load(os.path.join(store_dir, "elements.npy"), mmap_mode=mmap_mode)
+        self.shells = np.load(os.path.join(store_dir, "shells.npy"), mmap_mode=mmap_mode)
+        self.primitives = np.load(os.path.join(store_dir, "primitives.npy"), mmap_mode=mmap_mode)
+        self.content = np.load(os.path.join(store_dir, "content.npy"), mmap_mode=mmap_mode)
+
+        self._index = {str(el): n for n, el in enumerate(self.elements["element"])}
+        self._loaded = {}
+
+    def _row(self, el: str):
+        return self.elements[self._index[el]]
+
+    def __getitem__(self, el: str) -> verbatim_basis:
+        if el not in self._loaded:
+            row = self._row(el)
+            content = self.content[row["content_start"] : row["content_end"]].tobytes()
+            self._loaded[el] = verbatim_basis(
+                content=content.decode("utf-8"), all_electron=bool(row["all_electron"])
+            )
+        return self._loaded[el]
+
+    def __contains__(self, el) -> bool:
+        return el in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_checksum(self, el: str) -> str:
+        return self._row(el)["checksum"].decode("ascii")
+
+    def get_channels(self, el: str) -> list:
+        """
+        Shells of the element in the form of get_basis_fingerprint,
+        [shell type, [exponent, coefficient(s)], ...]
+        """
+        row = self._row(el)
+        channels = []
+        for shell in self.shells[row["shell_start"] : row["shell_end"]]:
+            columns = 3 if shell["lat"] == 1 else 2
+            primitives = self.primitives[shell["prim_start"] : shell["prim_end"], :columns]
+            channels.append([SHELL_TYPES[shell["lat"]]] + primitives.tolist())
+        return channels
+
+    def get_basis_set(self, els: list = None) -> dict:
+        """Input of get_basis_fingerprint for the given elements"""
+        return {el: self.get_channels(el) for el in (els or self)}
+
+
+def build_basis_store(repo_dir: str, store_dir: str, cache_dir: str = None) -> int:
+    """
+    Compile the basis set folder into store_dir,
+    replacing the previous store at once; returns the number of elements
+    """
+    from ab_initio_calculations.utils.pcrystal_utils import BasisRepo
+
+    repo = BasisRepo(repo_dir, cache_dir)
+    elements, shells, primitives, content = [], [], [], bytearray()
+    checksums = {}
+
+    for el in repo:
+        info = repo.registry.get(el)
+        checksums[el] = info.checksum
+        basis = repo[el]
+        bs_parsed = repo.get_parsed(basis.content, info.checksum)
+
+        encoded = basis.content.encode("utf-8")
+        shell_start = len(shells)
+        for shell in bs_parsed["bs"]:
+            ityb, lat, ng, che, scal = shell[0]
+            prim_start = len(primitives)
+            for prim in shell[1:]:
+                primitives.append(list(prim) + [0.0] * (PRIMITIVE_COLUMNS - len(prim)))
+            shells.append((ityb, lat, ng, che, scal, prim_start, len(primitives)))
+
+        elements.append(
+            (
+                el,
+                bs_parsed["header"][0],
+                basis.all_electron,
+                info.checksum.encode("ascii"),
+                len(content),
+                len(content) + len(encoded),
+                shell_start,
+                len(shells),
+            )
+        )
+        content += encoded
+
+    tmp_dir = store_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "elements.npy"), np.array(elements, dtype=ELEMENT_DTYPE))
+    np.save(os.path.join(tmp_dir, "shells.npy"), np.array(shells, dtype=SHELL_DTYPE))
+    np.save(
+        os.path.join(tmp_dir, "primitives.npy"),
+        np.array(primitives, dtype=float).reshape(-1, PRIMITIVE_COLUMNS),
+    )
+    np.save(os.path.join(tmp_dir, "content.npy"), np.frombuffer(bytes(content), dtype=np.uint8))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"source": os.path.abspath(repo_dir), "created": time.time(), "checksums": checksums}, f)
+
+    # the workers still mapping the old files keep them until they exit
+    old_dir = store_dir.rstrip(os.sep) + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    return len(elements)
+
+
+if __name__ == "__main__":
+    from ab_initio_calculations.settings import Settings
+
+    settings = Settings() if len(sys.argv) < 3 else None
+    repo_dir = sys.argv[1] if len(sys.argv) > 1 else settings.basis_sets_dir
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else settings.basis_store_dir
+    assert store_dir, "No basis_store_dir set in conf.ini"
+
+    start = time.perf_counter()
+    n_els = build_basis_store(repo_dir, store_dir, settings.basis_cache_dir if settings else None)
+    print(f"Compiled {n_els} basis sets from {repo_dir} to {store_dir} in {time.perf_counter() - start:.1f} s")
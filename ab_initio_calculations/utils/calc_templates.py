@@ -0,0 +1,142 @@
+import os
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import yaml
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEMPLATE_DIR = os.path.join(ROOT_DIR, "conf/templates")
+TEMPLATE_DIRS = (TEMPLATE_DIR, os.path.join(ROOT_DIR, "templates"))
+SCHEMA_PATH = os.path.join(ROOT_DIR, "templates/test_schema.yml")
+
+
+def freeze(obj):
+    """Read-only copy of the nested dicts and lists"""
+    if isinstance(obj, Mapping):
+        return MappingProxyType({key: freeze(value) for key, value in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(value) for value in obj)
+    return obj
+
+
+def thaw(obj):
+    """Mutable copy of the frozen parameters"""
+    if isinstance(obj, Mapping):
+        return {key: thaw(value) for key, value in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(value) for value in obj]
+    return obj
+
+
+def merge(base: dict, overrides: dict) -> dict:
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def get_schema_errors(template: Mapping, schema: Mapping, path: str = "") -> list[str]:
+    """
+    Structural check of a template against the sample one:
+    the sections of the schema must stay sections and its flags must stay flags,
+    the values themselves are validated by the D12 JSON schema
+    """
+    errors = []
+    for key, expected in schema.items():
+        if key not in template:
+            continue
+        value, key_path = template[key], f"{path}{key}"
+        if isinstance(expected, Mapping):
+            if not isinstance(value, Mapping):
+                errors.append(f"{key_path} must be a section")
+            else:
+                errors.extend(get_schema_errors(value, expected, key_path + "."))
+        elif isinstance(expected, bool) and not isinstance(value, bool):
+            errors.append(f"{key_path} must be true or false")
+    return errors
+
+
+class TemplateRegistry:
+    """
+    Calc setup templates, each file is parsed once per process;
+    a template may extend another one with "extends: <name>",
+    and the requested overlays are merged on top of it in order.
+    The resolved templates are validated once and handed out as read-only views,
+    which are shared rather than copied; use thaw() to get a mutable copy
+    """
+
+    def __init__(self, template_dirs=TEMPLATE_DIRS, schema_path=SCHEMA_PATH):
+        self.template_dirs = template_dirs
+        self.schema = None
+        if schema_path and os.path.exists(schema_path):
+            with open(schema_path) as f:
+                self.schema = yaml.load(f.read(), Loader=yaml.SafeLoader)
+
+        self._parsed = {}
+        self._resolved = {}
+        self._lock = threading.RLock()
+
+    def locate(self, template: str, near: str = None) -> str:
+        """Find the template by name, next to the template near first, if given"""
+        template_dirs = ((os.path.dirname(near),) if near else ()) + tuple(self.template_dirs)
+        for template_dir in template_dirs:
+            template_loc = os.path.join(template_dir, template)
+            if os.path.exists(template_loc):
+                return template_loc
+        if os.path.exists(template):
+            return template
+        raise FileNotFoundError(f"No template {template} found")
+
+    def load(self, template_loc: str) -> dict:
+        """Own content of the template file, before extending"""
+        with self._lock:
+            if template_loc not in self._parsed:
+                with open(template_loc) as f:
+                    calc = yaml.load(f.read(), Loader=yaml.SafeLoader)
+                if not isinstance(calc, Mapping):
+                    raise ValueError(f"Template {template_loc} is not a mapping")
+                self._parsed[template_loc] = calc
+            return self._parsed[template_loc]
+
+    def resolve(self, template: str, extended: tuple = ()) -> dict:
+        template_loc = os.path.abspath(self.locate(template, extended[-1] if extended else None))
+        if template_loc in extended:
+            raise ValueError(f"Circular templates: {' -> '.join(extended + (template_loc,))}")
+
+        calc = dict(self.load(template_loc))
+        base = calc.pop("extends", None)
+        if base:
+            calc = merge(self.resolve(base, extended + (template_loc,)), calc)
+        return calc
+
+    def get(self, template: str, *overlays: str) -> MappingProxyType:
+        key = (template,) + overlays
+        with self._lock:
+            if key not in self._resolved:
+                calc = self.resolve(template)
+                for overlay in overlays:
+                    calc = merge(calc, self.resolve(overlay))
+
+                errors = get_schema_errors(calc, self.schema) if self.schema else []
+                default = calc.get("default")
+                if not isinstance(default, Mapping) or not default.get("crystal"):
+                    errors.append("default.crystal is missing")
+                if errors:
+                    raise ValueError(f"Invalid template {' + '.join(key)}: {'; '.join(errors)}")
+
+                self._resolved[key] = freeze(calc)
+            return self._resolved[key]
+
+
+_registry = None
+
+
+def get_template_registry() -> TemplateRegistry:
+    global _registry
+    if _registry is None:
+        _registry = TemplateRegistry()
+    return _registry
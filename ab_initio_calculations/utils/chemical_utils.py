@@ -1,44 +1,25 @@
-import os
-import random
 import io
 import ase
 
-from ab_initio_calculations.settings import Settings
-
-settings = Settings()
+from ab_initio_calculations.utils.basis_registry import get_basis_registry
+from ab_initio_calculations.utils.structure_record import as_atoms
 
 
 def get_poscar_content(atoms_obj) -> str:
     """Convert ASE atoms object to POSCAR string."""
     with io.StringIO() as fd:
-        ase.io.write(fd, atoms_obj, format="vasp")
+        ase.io.write(fd, as_atoms(atoms_obj), format="vasp")
         return fd.getvalue()
     
 
 def get_list_of_basis_elements() -> list:
     """Return list with chemical elements with existing basis"""
-    dir = settings.basis_sets_dir
-
-    files = [
-        f.replace(".basis", "")
-        for f in os.listdir(
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), dir)
-        )
-    ]
-    return files
+    return get_basis_registry().elements()
 
 
-def get_random_element() -> list:
+def get_random_element() -> str:
     """Return random chemical element for which there exists a basis"""
-    dir = settings.basis_sets_dir
-
-    files = [
-        f.replace(".basis", "")
-        for f in os.listdir(
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), dir)
-        )
-    ]
-    return random.choice(files)
+    return get_basis_registry().random_element()
 
 
 def define_same_structures(structures: list[dict]) -> list[dict]:
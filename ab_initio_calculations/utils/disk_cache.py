@@ -0,0 +1,69 @@
+import os
+import threading
+
+
+class DiskLRUCache:
+    """On-disk cache, a file per key in a single folder.
+    Writes go through a temporary file of the process and thread, then a rename;
+    touching an entry on reading makes eviction drop the least recently
+    used ones first.
+    """
+
+    suffix = ""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: Folder to keep the entries in
+            max_bytes: Size limit of the cache folder
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def read(self, key: str) -> str:
+        """Content of the entry or None, without touching it"""
+        try:
+            with open(self._path(key), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def touch(self, key: str):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            # evicted by another process meanwhile
+            pass
+
+    def write(self, key: str, content: str):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries until the size limit is met"""
+        entries = []
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(self.suffix) and not item.name.endswith(".tmp"):
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,4 +1,11 @@
 import os
+import sqlite3
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from ab_initio_calculations.settings import Settings
+
+scanned_dir = namedtuple("scanned_dir", "path, mtime, subdirs, fort_mtime, error, first_line")
 
 
 def find_fort_and_input(root_dir: str) -> dict:
@@ -25,9 +32,191 @@ def find_fort_and_input(root_dir: str) -> dict:
     return error_dict
 
 
+def scan_dir(job: tuple) -> scanned_dir:
+    """
+    Look into a single directory, unless it is as it was at the last scan:
+    then subdirs is None and the stored ones are meant
+    """
+    path, known_mtime, known_fort_mtime = job
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == known_mtime:
+            # the files are rewritten in place by the reruns, the directory stays as is
+            fort_mtime = None
+            if known_fort_mtime is not None:
+                fort_mtime = os.stat(os.path.join(path, "fort.87")).st_mtime_ns
+            if fort_mtime == known_fort_mtime:
+                return scanned_dir(path, mtime, None, fort_mtime, None, None)
+
+        subdirs, files = [], set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    files.add(entry.name)
+    except FileNotFoundError:
+        return None
+
+    fort_mtime = error = first_line = None
+    if "fort.87" in files:
+        fort_path = os.path.join(path, "fort.87")
+        fort_mtime = os.stat(fort_path).st_mtime_ns
+        with open(fort_path, "r") as fort_file:
+            error = fort_file.read().strip()
+        if "INPUT" in files:
+            with open(os.path.join(path, "INPUT"), "r") as input_file:
+                first_line = input_file.readline().strip()
+
+    return scanned_dir(path, mtime, subdirs, fort_mtime, error, first_line)
+
+
+class ErrorIndex:
+    """
+    Persistent index of the fort.87 errors in the output trees,
+    (task dir) -> error, first INPUT line, fort.87 mtime;
+    a rescan reads only the directories changed since the previous one
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime INTEGER NOT NULL,
+                fort_mtime INTEGER
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                task_dir TEXT PRIMARY KEY,
+                error TEXT NOT NULL,
+                first_line TEXT,
+                mtime REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+
+    def forget(self, path: str):
+        """Drop the directory and everything below it"""
+        for table, column in (("dirs", "path"), ("tasks", "task_dir")):
+            # "0" follows "/", so the range is exactly the subtree
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)",
+                (path, path + "/", path + "0"),
+            )
+
+    def scan(self, root_dir: str, workers: int = None) -> dict:
+        """
+        Bring the index of root_dir up to date, level by level of the tree
+
+        Args:
+            root_dir: Output tree with the task directories
+            workers: Number of scanning processes, all cores by default (optional)
+
+        Returns:
+            dict: numbers of the scanned, changed and removed directories
+        """
+        root_dir = os.path.abspath(root_dir)
+        known, children = {}, defaultdict(list)
+        for path, parent, mtime, fort_mtime in self.conn.execute("SELECT * FROM dirs"):
+            known[path] = (mtime, fort_mtime)
+            children[parent].append(path)
+
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        stats = {"scanned": 0, "changed": 0, "removed": 0}
+        frontier = [(root_dir, None)]
+        try:
+            while frontier:
+                jobs = [(path,) + known.get(path, (None, None)) for path, _ in frontier]
+                if executor:
+                    chunksize = max(1, len(jobs) // (workers * 4))
+                    results = executor.map(scan_dir, jobs, chunksize=chunksize)
+                else:
+                    results = map(scan_dir, jobs)
+
+                next_frontier = []
+                for (path, parent), result in zip(frontier, results):
+                    stats["scanned"] += 1
+                    if result is None:
+                        self.forget(path)
+                        stats["removed"] += 1
+                        continue
+                    if result.subdirs is None:
+                        next_frontier.extend((subdir, path) for subdir in children[path])
+                        continue
+
+                    stats["changed"] += 1
+                    for subdir in set(children[path]) - set(result.subdirs):
+                        self.forget(subdir)
+                        stats["removed"] += 1
+                    next_frontier.extend((subdir, path) for subdir in result.subdirs)
+
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                        (path, parent, result.mtime, result.fort_mtime),
+                    )
+                    if result.error is None:
+                        self.conn.execute("DELETE FROM tasks WHERE task_dir = ?", (path,))
+                    else:
+                        self.conn.execute(
+                            "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?)",
+                            (path, result.error, result.first_line, result.fort_mtime / 1e9),
+                        )
+                self.conn.commit()
+                frontier = next_frontier
+        finally:
+            if executor:
+                executor.shutdown()
+        return stats
+
+    def get_errors(self, root_dir: str = None) -> dict:
+        """The same as find_fort_and_input, from the index"""
+        query = "SELECT error, first_line FROM tasks WHERE first_line IS NOT NULL"
+        params = ()
+        if root_dir:
+            root_dir = os.path.abspath(root_dir)
+            query += " AND (task_dir = ? OR (task_dir >= ? AND task_dir < ?))"
+            params = (root_dir, root_dir + "/", root_dir + "0")
+
+        error_dict = {}
+        for error, first_line in self.conn.execute(query + " ORDER BY task_dir", params):
+            error_dict.setdefault(error, []).append(first_line)
+        return error_dict
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_default_error_index():
+    """fort.87 error index configured in conf.ini, if any"""
+    try:
+        settings = Settings()
+    except FileNotFoundError:
+        return None
+    if not settings.error_index:
+        return None
+    return ErrorIndex(settings.error_index)
+
+
 if __name__ == "__main__":
     root_dir = "/root/projects/ab_initio_calculations/output"
-    error_dict = find_fort_and_input(root_dir)
+    error_index = get_default_error_index()
+    if error_index:
+        with error_index:
+            print(error_index.scan(root_dir))
+            error_dict = error_index.get_errors(root_dir)
+    else:
+        error_dict = find_fort_and_input(root_dir)
 
     for error, structures in error_dict.items():
         print(f"Error: {error}")
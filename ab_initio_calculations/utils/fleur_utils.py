@@ -1,22 +1,261 @@
+import asyncio
 import logging
 import os
-import shutil
+import signal
 import subprocess
 import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from pathlib import Path
 
 from ase import Atoms
 from ase.io import write as ase_write
 
+from ab_initio_calculations.utils.inpgen_cache import InpgenCache, get_default_inpgen_cache
+from ab_initio_calculations.utils.inpxml_variants import InpXmlVariants
+from ab_initio_calculations.utils.structure_record import as_atoms
+
+INPGEN_OPTS = ["-f", "fleur.inp", "-inc", "+all", "-noco"]
+# ready-made .inp files are converted as they are
+INP_FILE_OPTS = ["-f", "fleur.inp"]
+TMPFS_DIR = "/dev/shm"
+
+inpgen_result = namedtuple("inpgen_result", field_names="xml, elapsed, error")
+
+
+def get_inpgen_input(ase_obj, title: str = "%ABSDX_%") -> str:
+    """Textual inpgen input of a structure"""
+    buff = StringIO()
+    ase_write(
+        buff,
+        as_atoms(ase_obj),
+        format="fleur-inpgen",
+        parameters={
+            "title": title,
+        },
+    )
+    return buff.getvalue()
+
+
+def get_scratch_root(tmpfs: bool = False) -> str:
+    """Folder for the inpgen scratch folders, None for the system default"""
+    if tmpfs and os.path.isdir(TMPFS_DIR):
+        return TMPFS_DIR
+    return None
+
+
+def read_inpgen_output(tmp_dir: str, returncode: int, started: float) -> inpgen_result:
+    elapsed = time.perf_counter() - started
+    if returncode != 0:
+        return inpgen_result(None, elapsed, f"inpgen failed with code {returncode}")
+
+    xml_path = os.path.join(tmp_dir, "inp.xml")
+    if not os.path.exists(xml_path):
+        return inpgen_result(None, elapsed, "inpgen produced no result")
+
+    with open(xml_path, "r") as f:
+        return inpgen_result(f.read(), elapsed, None)
+
+
+def get_cached_inpgen(txt_input: str, cache: InpgenCache, opts: list = INPGEN_OPTS):
+    """Cache key and the cached result of the input, if any"""
+    if cache is None:
+        return None, None
+    started = time.perf_counter()
+    key = cache.get_key(txt_input, opts, os.environ["FLEUR_INPGEN_PATH"])
+    xml_input = cache.get(key)
+    if xml_input is None:
+        return key, None
+    return key, inpgen_result(xml_input, time.perf_counter() - started, None)
+
+
+def run_inpgen(
+    txt_input: str,
+    scratch_root: str = None,
+    timeout: float = None,
+    cache: InpgenCache = None,
+    opts: list = INPGEN_OPTS,
+) -> inpgen_result:
+    """
+    Run inpgen in a scratch folder of its own, return inp.xml with the timing or the error;
+    with a cache, the same input for the same inpgen binary is converted only once
+    """
+    try:
+        key, cached = get_cached_inpgen(txt_input, cache, opts)
+    except OSError as e:
+        return inpgen_result(None, 0.0, f"inpgen could not start: {e}")
+    if cached:
+        return cached
+
+    result = run_inpgen_uncached(txt_input, scratch_root, timeout, opts)
+    if key and result.xml:
+        cache.put(key, result.xml)
+    return result
+
+
+def run_inpgen_uncached(
+    txt_input: str, scratch_root: str = None, timeout: float = None, opts: list = INPGEN_OPTS
+) -> inpgen_result:
+    with tempfile.TemporaryDirectory(prefix="fleur_inpgen_", dir=scratch_root) as tmp_dir:
+        with open(os.path.join(tmp_dir, "fleur.inp"), "w") as f:
+            f.write(txt_input)
+
+        started = time.perf_counter()
+        try:
+            p = subprocess.Popen(
+                [os.environ["FLEUR_INPGEN_PATH"]] + opts,
+                cwd=tmp_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            return inpgen_result(None, time.perf_counter() - started, f"inpgen could not start: {e}")
+
+        try:
+            p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # a wrapper script may leave children holding the pipes
+            os.killpg(p.pid, signal.SIGKILL)
+            p.communicate()
+            return inpgen_result(None, time.perf_counter() - started, f"inpgen timed out after {timeout} s")
+
+        return read_inpgen_output(tmp_dir, p.returncode, started)
+
+
+def run_inpgen_batch(
+    structures,
+    workers: int = None,
+    tmpfs: bool = False,
+    timeout: float = None,
+    cache: InpgenCache = None,
+) -> list[inpgen_result]:
+    """
+    Run inpgen for many structures, at most workers subprocesses at once
+
+    Args:
+        structures: ase.Atoms or StructureRecord objects
+        workers: Number of concurrent inpgen processes (optional)
+        tmpfs: Keep the scratch folders in /dev/shm, if available (optional)
+        timeout: Seconds to wait for a single inpgen run (optional)
+        cache: inp.xml cache, the one from conf.ini by default (optional)
+
+    Returns:
+        list: inpgen_result (xml, elapsed, error) in the order of the structures
+    """
+    scratch_root = get_scratch_root(tmpfs)
+    cache = cache or get_default_inpgen_cache()
+
+    def convert(ase_obj):
+        try:
+            return run_inpgen(get_inpgen_input(ase_obj), scratch_root, timeout, cache)
+        except Exception as e:
+            return inpgen_result(None, 0.0, f"{type(e).__name__}: {e}")
+
+    # the work is done by the subprocesses, threads only wait for them
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(convert, structures))
+
+
+async def run_inpgen_async(
+    txt_input: str, scratch_root: str = None, timeout: float = None, cache: InpgenCache = None
+) -> inpgen_result:
+    """Asyncio counterpart of run_inpgen"""
+    try:
+        key, cached = get_cached_inpgen(txt_input, cache)
+    except OSError as e:
+        return inpgen_result(None, 0.0, f"inpgen could not start: {e}")
+    if cached:
+        return cached
+
+    result = await run_inpgen_uncached_async(txt_input, scratch_root, timeout)
+    if key and result.xml:
+        cache.put(key, result.xml)
+    return result
+
+
+async def run_inpgen_uncached_async(
+    txt_input: str, scratch_root: str = None, timeout: float = None
+) -> inpgen_result:
+    with tempfile.TemporaryDirectory(prefix="fleur_inpgen_", dir=scratch_root) as tmp_dir:
+        with open(os.path.join(tmp_dir, "fleur.inp"), "w") as f:
+            f.write(txt_input)
+
+        started = time.perf_counter()
+        try:
+            p = await asyncio.create_subprocess_exec(
+                os.environ["FLEUR_INPGEN_PATH"],
+                *INPGEN_OPTS,
+                cwd=tmp_dir,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            return inpgen_result(None, time.perf_counter() - started, f"inpgen could not start: {e}")
+
+        try:
+            await asyncio.wait_for(p.communicate(), timeout)
+        except asyncio.TimeoutError:
+            os.killpg(p.pid, signal.SIGKILL)
+            await p.wait()
+            return inpgen_result(None, time.perf_counter() - started, f"inpgen timed out after {timeout} s")
+
+        return read_inpgen_output(tmp_dir, p.returncode, started)
+
+
+async def run_inpgen_batch_async(
+    structures,
+    workers: int = None,
+    tmpfs: bool = False,
+    timeout: float = None,
+    cache: InpgenCache = None,
+) -> list[inpgen_result]:
+    """Asyncio counterpart of run_inpgen_batch"""
+    scratch_root = get_scratch_root(tmpfs)
+    cache = cache or get_default_inpgen_cache()
+    semaphore = asyncio.Semaphore(workers or os.cpu_count() or 1)
+
+    async def convert(ase_obj):
+        async with semaphore:
+            try:
+                return await run_inpgen_async(get_inpgen_input(ase_obj), scratch_root, timeout, cache)
+            except Exception as e:
+                return inpgen_result(None, 0.0, f"{type(e).__name__}: {e}")
+
+    return await asyncio.gather(*[convert(ase_obj) for ase_obj in structures])
+
 
 class Fleur_setup:
     """Class to prepare input for inpgen."""
     def __init__(self, ase_obj):
-        self.ase_obj = ase_obj
+        self.ase_obj = as_atoms(ase_obj)
+        self.xml_input = None
+        self.inpgen = None
+
+    @classmethod
+    def prepare_batch(
+        cls,
+        structures,
+        workers: int = None,
+        tmpfs: bool = False,
+        timeout: float = None,
+        cache: InpgenCache = None,
+    ) -> list:
+        """Setups of many structures with inpgen already run in a pool, see run_inpgen_batch"""
+        setups = [cls(ase_obj) for ase_obj in structures]
+        results = run_inpgen_batch([setup.ase_obj for setup in setups], workers, tmpfs, timeout, cache)
+        for setup, result in zip(setups, results):
+            setup.inpgen = result
+            setup.xml_input = result.xml
+        return setups
 
     def validate(self):
-        self.xml_input = self.ase_to_fleur_xml(self.ase_obj)
+        if self.inpgen is None:
+            self.xml_input = self.ase_to_fleur_xml(self.ase_obj)
         if not self.xml_input:
             return "Fleur inpgen misconfiguration occured"
         return None
@@ -25,82 +264,89 @@ class Fleur_setup:
         if self.xml_input:
             return self.xml_input.replace("%ABSDX_%", label)
 
+    def get_variants(self):
+        """Patched copies of the inp.xml for the parameter scans, see inpxml_variants"""
+        if self.xml_input:
+            return InpXmlVariants(self.xml_input)
+
     def ase_to_fleur_xml(self, ase_obj: Atoms):
         """
         Skipping the textual Fleur input generation
         in order to simplify our provenance persistence layers
         """
-        buff = StringIO()
-        ase_write(
-            buff,
-            ase_obj,
-            format="fleur-inpgen",
-            parameters={
-                "title": "%ABSDX_%",
-            },
-        )
-        buff.seek(0)
-        txt_input = buff.getvalue()
-
-        with tempfile.TemporaryDirectory(prefix="fleur_inpgen_") as tmp_dir:
-            input_path = os.path.join(tmp_dir, "fleur.inp")
-            with open(input_path, "w") as f:
-                f.write(txt_input)
-
-            opts = ["-f", "fleur.inp", "-inc", "+all", "-noco"]
-            p = subprocess.Popen(
-                [os.environ['FLEUR_INPGEN_PATH']] + opts,
-                cwd=tmp_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            p.communicate()
-            if p.returncode != 0:
-                logging.error("Bad news: inpgen failed")
-                return None
+        self.inpgen = run_inpgen(get_inpgen_input(ase_obj), cache=get_default_inpgen_cache())
+        if self.inpgen.error:
+            logging.error(f"Bad news: {self.inpgen.error}")
+            return None
 
-            xml_path = os.path.join(tmp_dir, "inp.xml")
-            if not os.path.exists(xml_path):
-                logging.error("Bad news: inpgen produced no result")
-                return None
+        return self.inpgen.xml
 
-            with open(xml_path, "r") as f:
-                xml_input = f.read()
 
-        return xml_input
-    
+def publish_xml(out_file: Path, content: str):
+    """Write the file next to its final place, then rename, so readers never see a partial one"""
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = out_file.with_name(f".{out_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_file.write_text(content, encoding="utf-8")
+    os.replace(tmp_file, out_file)
+
 
-def convert_inp_to_xml(inp_file: Path):
-    inp_dir = inp_file.parent
+def convert_inp_to_xml(
+    inp_file: Path, scratch_root: str = None, timeout: float = None, cache: InpgenCache = None
+):
+    """
+    Convert an .inp file to xml/<stem>/<stem>.xml next to it;
+    inpgen runs in a scratch folder of its own, so that any number of
+    conversions may go at once, even in the same folder
+    """
+    inp_file = Path(inp_file)
     name_stem = inp_file.stem
-    output_base_dir = inp_dir / "xml"
+    out_file = inp_file.parent / "xml" / name_stem / f"{name_stem}.xml"
 
     print(f"Processing {inp_file.name}...")
-    output_base_dir.mkdir(parents=True, exist_ok=True)
-
-    result = subprocess.run(
-        [os.environ['FLEUR_INPGEN_PATH'], "-f", str(inp_file)],
-        cwd=inp_dir
+    result = run_inpgen(
+        inp_file.read_text(), scratch_root, timeout, cache, opts=INP_FILE_OPTS
     )
-
-    if result.returncode != 0:
-        print(f"Error while processing {inp_file.name}")
+    if result.error:
+        print(f"Error while processing {inp_file.name}: {result.error}")
         return None
 
-    generated_xml = inp_dir / "inp.xml"
-    if not generated_xml.exists():
-        print(f"inp.xml not found for {inp_file.name}")
-        return None
+    publish_xml(out_file, result.xml)
+    print(f"Saved to {out_file}")
+    return out_file, result.xml
 
-    out_dir = output_base_dir / name_stem
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_file = out_dir / f"{name_stem}.xml"
 
-    shutil.move(str(generated_xml), str(out_file))
-    print(f"Saved to {out_file}")
+def convert_inp_batch(
+    inp_files,
+    workers: int = None,
+    tmpfs: bool = False,
+    timeout: float = None,
+    cache: InpgenCache = None,
+) -> list:
+    """
+    Convert many .inp files, at most workers inpgen processes at once
 
-    content = out_file.read_text(encoding="utf-8")
-    return out_file, content
+    Args:
+        inp_files: Paths of the .inp files
+        workers: Number of concurrent inpgen processes (optional)
+        tmpfs: Keep the scratch folders in /dev/shm, if available (optional)
+        timeout: Seconds to wait for a single inpgen run (optional)
+        cache: inp.xml cache, the one from conf.ini by default (optional)
+
+    Returns:
+        list: (out_file, content) or None for failed files, in the order of inp_files
+    """
+    scratch_root = get_scratch_root(tmpfs)
+    cache = cache or get_default_inpgen_cache()
+
+    def convert(inp_file):
+        try:
+            return convert_inp_to_xml(inp_file, scratch_root, timeout, cache)
+        except Exception as e:
+            print(f"Error while processing {Path(inp_file).name}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(convert, inp_files))
 
 
 if __name__ == "__main__":
@@ -115,16 +361,16 @@ if __name__ == "__main__":
         inp_files = sorted(dir.rglob("*.inp"))  
         return [inp_file.resolve() for inp_file in inp_files]
 
-    base_dir = os.environ['FLEUR_INP_DIR']
+    base_dir = Path(os.environ['FLEUR_INP_DIR'])
+    inp_files = list_inp_files(base_dir)
     errors = []
-    for file in list_inp_files(base_dir):
-        try:
-            out_file, content = convert_inp_to_xml(file)
-            print(f"Converted {file.name} to XML and saved to {out_file}")
-        except:
+    for file, converted in zip(inp_files, convert_inp_batch(inp_files)):
+        if converted is None:
             errors.append(file)
             print(f"Failed to convert {file.name}")
-            
+        else:
+            print(f"Converted {file.name} to XML and saved to {converted[0]}")
+
     if errors:
         print("Errors occurred for the following files:")
         for error_file in errors:
@@ -0,0 +1,64 @@
+import numpy as np
+import spglib
+from aiida_crystal_dft.utils.geometry import get_centering_code, get_crystal_system
+
+from ab_initio_calculations.utils.structure_record import as_atoms
+
+VECTOR_FORMAT = "{:17.9E} {:17.9E} {:17.9E}"
+ATOM_FORMAT = "{:3} {:17.9E} {:17.9E} {:17.9E}"
+
+
+def get_fort34(ase_obj, ecp_numbers=()) -> str:
+    """
+    fort.34 of a structure, byte-identical to str(Fort34(basis).from_ase(ase_obj))
+    of aiida_crystal_dft, with the cell, symmetry operators and atoms
+    formatted in one go rather than line by line;
+    ecp_numbers are the atomic numbers having the ECP basis sets
+    """
+    ase_obj = as_atoms(ase_obj)
+    if not all(ase_obj.pbc):
+        raise NotImplementedError("Structure with dimensionality < 3 currently not supported")
+
+    cell = (ase_obj.get_cell(), ase_obj.get_scaled_positions(), ase_obj.get_atomic_numbers())
+
+    # Fort34 keeps the conventional cell, then writes its primitive one;
+    # spglib.find_primitive used for the header is the same primitive standardization,
+    # so a single symmetry search serves both the header and the body
+    conventional = spglib.standardize_cell(cell, to_primitive=False, no_idealize=False)
+    primitive = spglib.standardize_cell(conventional, to_primitive=True, no_idealize=False)
+    abc, positions, atomic_numbers = primitive
+    dataset = spglib.get_symmetry_dataset(primitive)
+
+    space_group = dataset.number
+    crystal_type = get_crystal_system(space_group, as_number=True)
+    centring = get_centering_code(space_group, dataset.international)
+
+    # leave only symmetrically inequivalent atoms, in cartesian coordinates
+    inequiv_atoms = np.unique(dataset.equivalent_atoms)
+    positions = np.dot(abc.T, positions[inequiv_atoms].T).T
+    atomic_numbers = atomic_numbers[inequiv_atoms]
+    if len(ecp_numbers):
+        atomic_numbers = np.where(np.isin(atomic_numbers, ecp_numbers), atomic_numbers + 200, atomic_numbers)
+
+    # symmetry operations from fractional to cartesian, four rows per operation
+    rotations = np.dot(abc.T, np.dot(dataset.rotations, np.linalg.inv(abc.T)))
+    rotations = np.swapaxes(rotations, 0, 1)
+    translations = np.dot(dataset.translations, abc)
+    n_symops = len(dataset.translations)
+    symops = np.stack(
+        [rotations[:, 0], rotations[:, 1], rotations[:, 2], translations], axis=1
+    ).reshape(n_symops * 4, 3)
+
+    vectors = np.round(np.concatenate([abc, symops]), 9) + 0.0
+    atoms = np.column_stack([atomic_numbers.astype(object), positions.astype(object)])
+
+    return "\n".join(
+        [
+            f"3 {centring} {crystal_type}",
+            "\n".join([VECTOR_FORMAT] * 3).format(*vectors[:3].ravel().tolist()),
+            str(n_symops),
+            "\n".join([VECTOR_FORMAT] * len(symops)).format(*vectors[3:].ravel().tolist()),
+            str(len(atomic_numbers)),
+            "\n".join([ATOM_FORMAT] * len(atomic_numbers)).format(*atoms.ravel().tolist()),
+        ]
+    )
@@ -0,0 +1,69 @@
+import hashlib
+import os
+
+from ab_initio_calculations.settings import Settings
+from ab_initio_calculations.utils.disk_cache import DiskLRUCache
+
+_binary_hashes = {}
+
+
+def get_binary_version(path: str) -> str:
+    """Hash of the inpgen binary, recomputed only if the file changes"""
+    stat = os.stat(path)
+    stamp = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _binary_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _binary_hashes[stamp] = digest.hexdigest()
+    return _binary_hashes[stamp]
+
+
+class InpgenCache(DiskLRUCache):
+    """On-disk cache of the inp.xml produced by inpgen.
+    Entries are named by the hash of the textual inpgen input, the options
+    and the inpgen binary; the title placeholder stays in the stored XML.
+    """
+
+    suffix = ".xml"
+
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__(cache_dir, max_bytes)
+
+    @staticmethod
+    def get_key(txt_input: str, opts: list, binary: str) -> str:
+        digest = hashlib.sha256()
+        for part in (get_binary_version(binary), " ".join(opts), txt_input):
+            digest.update(part.encode("utf-8") + b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> str:
+        """Return cached inp.xml or None"""
+        xml_input = self.read(key)
+        if xml_input is not None:
+            self.touch(key)
+        return xml_input
+
+    def put(self, key: str, xml_input: str):
+        self.write(key, xml_input)
+
+
+_default_cache = False
+
+
+def get_default_inpgen_cache():
+    """inp.xml cache configured in conf.ini, if any"""
+    global _default_cache
+    if _default_cache is False:
+        try:
+            settings = Settings()
+        except FileNotFoundError:
+            settings = None
+        if settings and settings.inpgen_cache_dir:
+            _default_cache = InpgenCache(
+                settings.inpgen_cache_dir, max_bytes=settings.inpgen_cache_max_mb * 1024 * 1024
+            )
+        else:
+            _default_cache = None
+    return _default_cache
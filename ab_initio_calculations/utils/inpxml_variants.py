@@ -0,0 +1,143 @@
+"""
+Variants of a Fleur inp.xml for the parameter scans, made by editing
+the parsed tree of a single inpgen output rather than running inpgen again.
+
+Parameters:
+    itmax, minDistance, maxIterBroyd, imix, alpha, spinf: calculationSetup/scfLoop
+    fermiSmearingEnergy: cell/bzIntegration
+    kmesh: (n1, n2, n3) Gamma-centred mesh, reduced by the symmetry of inp.xml
+    kpoints: [((k1, k2, k3), weight), ...] explicit list, in reciprocal lattice units
+"""
+
+import copy
+import itertools
+
+import numpy as np
+from lxml import etree
+
+SCF_LOOP_ATTRIBUTES = ("itmax", "minDistance", "maxIterBroyd", "imix", "alpha", "spinf")
+BZ_INTEGRATION_ATTRIBUTES = ("fermiSmearingEnergy",)
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return "T" if value else "F"
+    if isinstance(value, float):
+        return f"{value:.8f}"
+    return str(value)
+
+
+def get_rotations(tree) -> np.ndarray:
+    """Rotations of the symmetry operations in lattice coordinates, identity if none written"""
+    rotations = [
+        [[int(float(x)) for x in op.find(f"row-{n}").text.split()[:3]] for n in (1, 2, 3)]
+        for op in tree.iterfind("cell/symmetryOperations/symOp")
+    ]
+    return np.array(rotations or [np.eye(3, dtype=int)])
+
+
+def get_kmesh(rotations: np.ndarray, mesh) -> list:
+    """
+    Irreducible points of the Gamma-centred mesh with their weights;
+    points related by a rotation or by time reversal are merged
+    """
+    mesh = np.array(mesh, dtype=int)
+    grid = np.array(list(itertools.product(*(range(n) for n in mesh))))
+    index = np.ravel_multi_index(grid.T, mesh)
+    representative = index.copy()
+
+    # k transforms with the transposed rotation, k R as a row vector
+    for rotation in np.concatenate([rotations, -rotations]):
+        image = (grid / mesh) @ rotation * mesh
+        on_mesh = np.all(np.abs(image - np.round(image)) < 1e-8, axis=1)
+        if not on_mesh.all():
+            # the operation does not keep this mesh, e.g. swaps axes of unequal divisions
+            continue
+        image = np.mod(np.round(image).astype(int), mesh)
+        representative = np.minimum(representative, np.ravel_multi_index(image.T, mesh))
+
+    irreducible, weights = np.unique(representative, return_counts=True)
+    points = np.array(np.unravel_index(irreducible, mesh)).T / mesh
+    # to the first Brillouin zone, (-0.5, 0.5]
+    points = np.where(points > 0.5, points - 1.0, points)
+    return [(tuple(point), weight / len(index)) for point, weight in zip(points, weights)]
+
+
+def set_kpoints(tree, kpoints: list, name: str):
+    """Replace or add the k-point list and select it"""
+    bz = tree.find("cell/bzIntegration")
+    selection = bz.find("kPointListSelection") if bz is not None else None
+    lists = bz.find("kPointLists") if bz is not None else None
+    if selection is None or lists is None:
+        raise ValueError("inp.xml has no kPointLists to edit")
+
+    for old in lists.findall("kPointList"):
+        if old.get("name") == name:
+            lists.remove(old)
+
+    kpoint_list = etree.SubElement(lists, "kPointList", name=name, count=str(len(kpoints)), type="mesh")
+    for point, weight in kpoints:
+        kpoint = etree.SubElement(kpoint_list, "kPoint", weight=f"{weight:.16f}")
+        kpoint.text = " ".join(f"{x:.16f}" for x in point)
+    selection.set("listName", name)
+
+
+class InpXmlVariants:
+    """
+    Patched copies of a base inp.xml, such as the one of Fleur_setup or convert_inp_to_xml;
+    the base is parsed once, k-point lists are built once per mesh,
+    each variant is a copy of the tree serialized once
+    """
+
+    def __init__(self, xml_input: str):
+        self.tree = etree.fromstring(xml_input.encode("utf-8"))
+        start = xml_input.find("<" + self.tree.tag)
+        self.head = xml_input[:start] if start > 0 else ""
+        self.tail = xml_input[xml_input.rfind(">") + 1 :]
+        self._rotations = None
+        self._kmeshes = {}
+
+    def get_kmesh(self, mesh) -> list:
+        mesh = tuple(int(n) for n in mesh)
+        if mesh not in self._kmeshes:
+            if self._rotations is None:
+                self._rotations = get_rotations(self.tree)
+            self._kmeshes[mesh] = get_kmesh(self._rotations, mesh)
+        return self._kmeshes[mesh]
+
+    def patch(self, tree, params: dict):
+        for key, value in params.items():
+            if key in SCF_LOOP_ATTRIBUTES or key in BZ_INTEGRATION_ATTRIBUTES:
+                path = "calculationSetup/scfLoop" if key in SCF_LOOP_ATTRIBUTES else "cell/bzIntegration"
+                node = tree.find(path)
+                if node is None:
+                    raise ValueError(f"inp.xml has no {path} for {key}")
+                node.set(key, format_value(value))
+            elif key == "kmesh":
+                set_kpoints(tree, self.get_kmesh(value), "mesh-" + "x".join(str(n) for n in value))
+            elif key == "kpoints":
+                set_kpoints(tree, value, "custom")
+            else:
+                raise ValueError(f"Unknown inp.xml parameter {key}")
+
+    def derive(self, params: dict) -> str:
+        """inp.xml with the parameters set"""
+        tree = copy.deepcopy(self.tree)
+        self.patch(tree, params)
+        return self.head + etree.tostring(tree, encoding="unicode") + self.tail
+
+    def scan(self, grid: dict):
+        """
+        Variants over all the combinations of the parameter values
+
+        Args:
+            grid: Parameter name to the list of its values,
+                e.g. {"kmesh": [(8, 8, 8), (12, 12, 12)], "itmax": [15, 30]}
+
+        Yields:
+            tuple: params dict and its inp.xml
+        """
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            params = dict(zip(keys, values))
+            yield params, self.derive(params)
@@ -1,60 +1,270 @@
+import json
 import os
-from collections import namedtuple
+import threading
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache, partial
 import ase
-import yaml
+from ase.data import atomic_numbers
 from aiida_crystal_dft.io.basis import BasisFile
 from aiida_crystal_dft.io.d12 import D12
-from aiida_crystal_dft.io.f34 import Fort34
-from ase.data import chemical_symbols
 
 from ab_initio_calculations.settings import Settings
-
-TEMPLATE_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "conf/templates"
+from ab_initio_calculations.utils.basis_registry import get_basis_registry, verbatim_basis
+from ab_initio_calculations.utils.basis_store import BasisStore, get_store_source, is_store_current
+from ab_initio_calculations.utils.calc_templates import (
+    freeze,
+    get_template_registry,
+    merge,
+    thaw,
 )
-ELS_REPO_DIR = Settings().basis_sets_dir
+from ab_initio_calculations.utils.fort34 import get_fort34
+from ab_initio_calculations.utils.structure_record import as_atoms
+from ab_initio_calculations.utils.task_bundle import TaskBundleWriter
 
-verbatim_basis = namedtuple("basis", field_names="content, all_electron")
+DEFAULT_TEMPLATE = "pcrystal_demo.yml"
+settings = Settings()
+ELS_REPO_DIR = settings.basis_sets_dir
+BASIS_CACHE_DIR = settings.basis_cache_dir
+BASIS_STORE_DIR = settings.basis_store_dir
 
 
-def get_basis_sets(repo_dir=ELS_REPO_DIR):
+class BasisRepo(Mapping):
+    """
+    Available BS, element -> verbatim_basis;
+    an element is read and parsed on first access and then memoized,
+    parsed BS are kept on disk by the checksum of the file, if cache_dir is set
     """
-    Keeps all available BS in a dict for convenience
+
+    def __init__(self, repo_dir: str, cache_dir: str = None):
+        self.registry = get_basis_registry(repo_dir)
+        self.family = self.registry.basis_dir
+        self.cache_dir = cache_dir
+        self._loaded = {}
+
+    def get_parsed(self, content: str, checksum: str) -> dict:
+        if not self.cache_dir:
+            return BasisFile().parse(content)
+
+        path = os.path.join(self.cache_dir, checksum + ".json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+
+        bs_parsed = BasisFile().parse(content)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(bs_parsed, f)
+        os.replace(tmp_path, path)
+        return bs_parsed
+
+    def __getitem__(self, el: str) -> verbatim_basis:
+        info = self.registry.get(el)
+        if info is None:
+            raise KeyError(el)
+
+        loaded = self._loaded.get(el)
+        if loaded and loaded[0] == info.checksum:
+            return loaded[1]
+
+        with open(info.path, "r") as f:
+            bs_str = f.read().strip()
+        bs_parsed = self.get_parsed(bs_str, info.checksum)
+        basis = verbatim_basis(content=bs_str, all_electron=("ecp" not in bs_parsed))
+
+        self._loaded[el] = (info.checksum, basis)
+        return basis
+
+    def get_checksum(self, el: str) -> str:
+        info = self.registry.get(el)
+        if info is None:
+            raise KeyError(el)
+        return info.checksum
+
+    def __contains__(self, el) -> bool:
+        return el in self.registry
+
+    def __iter__(self):
+        return iter(self.registry.elements())
+
+    def __len__(self):
+        return len(self.registry)
+
+
+def get_basis_sets(repo_dir=ELS_REPO_DIR, cache_dir=BASIS_CACHE_DIR, store_dir=BASIS_STORE_DIR):
+    """
+    Keeps all available BS in a mapping for convenience,
+    memory-mapped from the compiled store if it was built from repo_dir as it is now
     NB we assume BS repo_dir = AiiDA's *basis_family*
     """
-    assert os.path.exists(repo_dir), "No folder %s with the basis sets found" % repo_dir
+    if store_dir and get_store_source(store_dir) == os.path.abspath(repo_dir):
+        if is_store_current(store_dir, repo_dir):
+            return BasisStore(store_dir)
+        print(f"[WARNING] Basis store {store_dir} is outdated, rebuild it; reading {repo_dir}")
+    return BasisRepo(repo_dir, cache_dir)
 
-    bs_repo = {}
-    for filename in os.listdir(repo_dir):
-        if not filename.endswith(".basis"):
-            continue
 
-        el = filename.split(".")[0]
-        assert el in chemical_symbols, "Unexpected basis set file %s" % filename
-        with open(repo_dir + os.sep + filename, "r") as f:
-            bs_str = f.read().strip()
+def get_template(template=DEFAULT_TEMPLATE):
+    """
+    Templates control the calc setup which is not supposed to be changed;
+    a mutable copy, template may also be a tuple of a base and its overlays
+    """
+    return thaw(get_frozen_template(template))
+
+
+def get_frozen_template(template=DEFAULT_TEMPLATE):
+    """Shared read-only view of the template, parsed and validated once"""
+    if isinstance(template, tuple):
+        return get_template_registry().get(*template)
+    return get_template_registry().get(template)
+
+
+tolerance_rule = namedtuple("tolerance_rule", field_names="name, elements, overrides")
+
+# the first rule having any element of a structure applies,
+# its overrides are merged into the "default" section of the template
+TOLERANCE_RULES = (
+    tolerance_rule(
+        "high_tolinteg",
+        ("Ta", "Se", "P"),
+        {"crystal": {"scf": {"numerical": {"TOLINTEG": [8, 8, 8, 8, 16]}}}},
+    ),
+    tolerance_rule(
+        "very_high_tolinteg",
+        ("C", "Ag", "Mg", "Tc", "Ni", "Sb", "Pr"),
+        {
+            "crystal": {"scf": {"numerical": {"TOLINTEG": [20, 20, 20, 20, 40], "TOLDEE": 6}}},
+            "properties": {"shrink": 8},
+        },
+    ),
+    tolerance_rule(
+        "low_tolinteg",
+        ("P", "Se", "Mn", "Fe", "Ru", "V", "Tc"),
+        {
+            "crystal": {"scf": {"numerical": {"TOLINTEG": [6, 6, 6, 6, 12], "TOLDEE": 6}}},
+            "properties": {"shrink": 7},
+        },
+    ),
+    tolerance_rule(
+        "dense_kpoints",
+        ("Co", "Cr"),
+        {
+            "crystal": {
+                "scf": {
+                    "k_points": [32, 32],
+                    "numerical": {"TOLINTEG": [8, 8, 8, 8, 16], "TOLDEE": 8},
+                }
+            }
+        },
+    ),
+    tolerance_rule(
+        "slow_convergence",
+        ("Es",),
+        {
+            "crystal": {
+                "scf": {
+                    "k_points": [10, 10],
+                    "numerical": {
+                        "TOLINTEG": [8, 8, 8, 8, 16],
+                        "TOLDEE": 8,
+                        "MAXCYCLE": 1000,
+                        "FMIXING": 90,
+                    },
+                }
+            }
+        },
+    ),
+)
 
-        bs_parsed = BasisFile().parse(bs_str)
-        bs_repo[el] = verbatim_basis(
-            content=bs_str, all_electron=("ecp" not in bs_parsed)
-        )
 
-    return bs_repo
+def get_tolerance_rule(els, rules=TOLERANCE_RULES) -> tolerance_rule:
+    """First rule matching any of the elements, or None"""
+    els = set(els)
+    for rule in rules:
+        if els.intersection(rule.elements):
+            return rule
+    return None
 
 
-def get_template(template="pcrystal_demo.yml"):
+@lru_cache(maxsize=None)
+def get_calc_params(template: str = DEFAULT_TEMPLATE, rule_name: str = None):
+    """
+    Read-only "default" section of the template with the tolerance rule applied,
+    built once per (template, rule)
     """
-    Templates control the calc setup which is not supposed to be changed
+    calc = get_frozen_template(template)["default"]
+
+    if rule_name:
+        rule = next(rule for rule in TOLERANCE_RULES if rule.name == rule_name)
+        calc = merge(calc, rule.overrides)
+    return freeze(calc)
+
+
+BASIS_PLACEHOLDER = "__BASIS__"
+BASIS_BLOCK_CACHE_SIZE = 4096
+
+_basis_blocks = OrderedDict()
+_basis_blocks_lock = threading.Lock()
+
+
+def get_basis_block(bs_repo, els) -> str:
     """
-    template_loc = os.path.join(TEMPLATE_DIR, template)
-    if not os.path.exists(template_loc):
-        template_loc = template
+    Basis section of a D12 input as D12 renders it, for the sorted elements,
+    LRU cached by the basis family and the elements with the checksums of their files,
+    so that a changed file is rendered anew
+    """
+    els = sorted(els)
+    key = (bs_repo.family, tuple((el, bs_repo.get_checksum(el)) for el in els))
+    with _basis_blocks_lock:
+        if key in _basis_blocks:
+            _basis_blocks.move_to_end(key)
+            return _basis_blocks[key]
+
+    block = "\n".join([bs_repo[el].content for el in els] + ["99 0\n"])
+    block = "\n".join([line.strip() for line in block.split("\n") if line.strip()])
+
+    with _basis_blocks_lock:
+        _basis_blocks[key] = block
+        if len(_basis_blocks) > BASIS_BLOCK_CACHE_SIZE:
+            _basis_blocks.popitem(last=False)
+    return block
+
+
+@lru_cache(maxsize=None)
+def render_d12_deck(template: str, rule_name: str) -> str:
+    """D12 input with the default title line and a placeholder instead of the basis"""
+    calc_params_crystal = thaw(get_calc_params(template, rule_name)["crystal"])
+    deck = str(D12(parameters=calc_params_crystal, basis=BASIS_PLACEHOLDER + "\n"))
+    assert deck.count(BASIS_PLACEHOLDER) == 1
+    return deck
+
+
+def render_d12(template: str, rule_name: str, els: tuple) -> str:
+    """D12 input with the default title line, the cached basis block spliced in"""
+    return render_d12_deck(template, rule_name).replace(
+        BASIS_PLACEHOLDER, get_basis_block(Pcrystal_setup.els_repo, els)
+    )
 
-    assert os.path.exists(template_loc)
 
-    with open(template_loc) as f:
-        calc = yaml.load(f.read(), Loader=yaml.SafeLoader)
-    return calc
+def set_d12_label(d12: str, label: str) -> str:
+    """Replace the title line of a rendered D12 input"""
+    title = [line.strip() for line in str(label).split("\n") if line.strip()]
+    return "\n".join(title + [d12.split("\n", 1)[1]])
+
+
+class lazy_class_attribute:
+    """Class attribute computed on first access, then stored on the class"""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __get__(self, obj, owner):
+        value = self.func()
+        setattr(owner, self.name, value)
+        return value
 
 
 def get_input(calc_params_crystal, elements, bs_src, label):
@@ -63,10 +273,13 @@ def get_input(calc_params_crystal, elements, bs_src, label):
     """
     calc_params_crystal["label"] = label
 
-    if isinstance(bs_src, dict):
-        return D12(
-            parameters=calc_params_crystal, basis=[bs_src[el] for el in elements]
-        )
+    if isinstance(bs_src, (BasisRepo, BasisStore)):
+        # the block lacks the newline D12 puts after "99 0"
+        return D12(parameters=calc_params_crystal, basis=get_basis_block(bs_src, elements) + "\n")
+
+    elif isinstance(bs_src, Mapping):
+        # a plain element -> basis mapping, not cached
+        return D12(parameters=calc_params_crystal, basis=[bs_src[el] for el in elements])
 
     elif isinstance(bs_src, str):
         return D12(parameters=calc_params_crystal, basis=bs_src)
@@ -75,18 +288,18 @@ def get_input(calc_params_crystal, elements, bs_src, label):
 
 
 class Pcrystal_setup:
-    els_repo = get_basis_sets()
-    calc_setup = get_template()
-    assert calc_setup["default"]["crystal"]
+    @lazy_class_attribute
+    def els_repo():
+        return get_basis_sets()
 
-    def __init__(self, ase_obj, custom_template=None):
-        self.ase_obj = ase_obj
-        self.els = list(set(self.ase_obj.get_chemical_symbols()))
-        self.custom_template = None
+    def __init__(self, ase_obj, custom_template=None, tolerance_rules=False):
+        self.ase_obj = as_atoms(ase_obj)
+        self.els = sorted(set(self.ase_obj.get_chemical_symbols()))
+        self.template = custom_template or DEFAULT_TEMPLATE
+        self.rule = get_tolerance_rule(self.els) if tolerance_rules else None
 
-        if custom_template:
-            self.custom_template = get_template(custom_template)
-            assert self.custom_template["default"]["crystal"]
+        # fail early on a broken custom template
+        get_calc_params(self.template)
 
     def validate(self):
         for el in self.els:
@@ -96,67 +309,160 @@ class Pcrystal_setup:
         return None
 
     def get_input_struct(self):
-        f34_input = Fort34([Pcrystal_setup.els_repo[el] for el in self.els])
-        return str(f34_input.from_ase(self.ase_obj))
+        ecp_numbers = [
+            atomic_numbers[el] for el in self.els if not Pcrystal_setup.els_repo[el].all_electron
+        ]
+        return get_fort34(self.ase_obj, ecp_numbers)
+
+    def get_calc_params(self):
+        return get_calc_params(self.template, self.rule.name if self.rule else None)
 
     def get_input_setup(self, label):
-        return str(
-            get_input(
-                (
-                    self.custom_template["default"]["crystal"]
-                    if self.custom_template
-                    else Pcrystal_setup.calc_setup["default"]["crystal"]
-                ),
-                self.els,
-                Pcrystal_setup.els_repo,
-                label,
-            )
-        )
+        d12 = render_d12(self.template, self.rule.name if self.rule else None, tuple(self.els))
+        return set_d12_label(d12, label)
 
 
-def convert_to_pcrystal_input(dir: str, atoms_obj: list[ase.Atoms], entry: str = None) -> str:
-    """Convert structures from ase.Atoms to Pcrystal input format (d12, fort.34)"""
-    el_high_tolinteg = ["Ta", "Se", "P"]
+def get_pcrystal_task(ase_obj, entry: str = None, template: str = DEFAULT_TEMPLATE) -> tuple[str, dict]:
+    """Task name and the yascheduler files (INPUT and fort.34) of a structure"""
+    ase_obj = as_atoms(ase_obj)
+    setup = Pcrystal_setup(ase_obj, custom_template=template, tolerance_rules=True)
+
+    files = {"INPUT": setup.get_input_setup("test " + entry), "fort.34": setup.get_input_struct()}
+    return f"pcrystal_input_{ase_obj.get_chemical_formula()}_{entry}", files
+
+
+def write_pcrystal_task(
+    dir: str, ase_obj, entry: str = None, template: str = DEFAULT_TEMPLATE
+) -> tuple[str, str]:
+    """Write INPUT (d12) and fort.34 of a structure into its own task folder"""
+    ase_obj = as_atoms(ase_obj)
+    name, files = get_pcrystal_task(ase_obj, entry, template)
+    input, fort34 = files["INPUT"], files["fort.34"]
+
+    subdir = os.path.join(dir, name)
+    os.makedirs(subdir, exist_ok=True)
+
+    input_file = os.path.join(subdir, f"input_{ase_obj.get_chemical_formula()}_{entry}")
+    fort_file = os.path.join(subdir, f"fort.34")
+
+    with open(input_file, "w") as f_input:
+        f_input.write(input)
+    with open(fort_file, "w") as f_fort:
+        f_fort.write(fort34)
+
+    return input_file, fort_file
 
-    for ase_obj in atoms_obj:
-        setup = Pcrystal_setup(ase_obj)
-        
-        if any([el in el_high_tolinteg for el in set(ase_obj.symbols)]):
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLINTEG"] = [8, 8, 8, 8, 16]
-            
-        elif any([i in list(ase_obj.symbols) for i in ['C', 'Ag', 'Mg', 'Tc', 'Ni', 'Sb', 'Pr']]):
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLINTEG"] = [20, 20, 20, 20, 40]
-            setup.calc_setup["default"]["properties"]["shrink"] = 8
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLDEE"] = 6
-        elif any([i in list(ase_obj.symbols) for i in ['P', 'Se', 'Mn', 'Fe', 'Ru', 'V', 'Tc']]):
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLINTEG"] = [6, 6, 6, 6, 12]
-            setup.calc_setup["default"]["properties"]["shrink"] = 7
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLDEE"] = 6
-        elif any([i in list(ase_obj.symbols) for i in ['Co', 'Cr']]):
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLINTEG"] = [8, 8, 8, 8, 16]
-            setup.calc_setup["default"]["crystal"]["scf"]['k_points'] = [32, 32]
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLDEE"] = 8
-        elif any([i in list(ase_obj.symbols) for i in ['Es']]):
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLINTEG"] = [8, 8, 8, 8, 16]
-            setup.calc_setup["default"]["crystal"]["scf"]['k_points'] = [10, 10]
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["TOLDEE"] = 8
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["MAXCYCLE"] = 1000
-            setup.calc_setup["default"]["crystal"]["scf"]["numerical"]["FMIXING"] = 90
-
-
-        input = setup.get_input_setup("test " + entry)
-        fort34 = setup.get_input_struct()
-
-        subdir = os.path.join(dir, f"pcrystal_input_{ase_obj.get_chemical_formula()}_{entry}")
-        os.makedirs(subdir, exist_ok=True)
-
-        input_file = os.path.join(subdir, f"input_{ase_obj.get_chemical_formula()}_{entry}")
-        fort_file = os.path.join(subdir, f"fort.34")
-
-        with open(input_file, "w") as f_input:
-            f_input.write(input)
-        with open(fort_file, "w") as f_fort:
-            f_fort.write(fort34)
 
+def convert_to_pcrystal_input(dir: str, atoms_obj: list[ase.Atoms], entry: str = None) -> str:
+    """
+    Convert structures from ase.Atoms to Pcrystal input format (d12, fort.34),
+    returns the input of the last one
+    """
+    input_file = None
+    for ase_obj in atoms_obj:
+        input_file, fort_file = write_pcrystal_task(dir, ase_obj, entry)
         print(f"Data written to {input_file} and {fort_file}")
-        return input_file
\ No newline at end of file
+
+    return input_file
+
+
+def write_pcrystal_task_item(dir: str, template: str, item: tuple) -> dict:
+    ase_obj, entry = item
+    input_file, fort_file = write_pcrystal_task(dir, ase_obj, entry, template)
+    return {"entry": entry, "input": input_file, "fort34": fort_file, "error": None}
+
+
+def get_pcrystal_task_item(template: str, item: tuple) -> dict:
+    ase_obj, entry = item
+    name, files = get_pcrystal_task(ase_obj, entry, template)
+    return {"entry": entry, "name": name, "files": files}
+
+
+def get_failed_task(entry: str, error: Exception) -> dict:
+    return {"entry": entry, "input": None, "fort34": None, "error": f"{type(error).__name__}: {error}"}
+
+
+def generate_pcrystal_inputs(
+    dir: str,
+    items,
+    workers: int = None,
+    max_pending: int = None,
+    template: str = DEFAULT_TEMPLATE,
+    bundle: str = None,
+) -> list[dict]:
+    """
+    Write the task folders of many structures in a process pool
+
+    Args:
+        dir: Folder to create the task folders in
+        items: Iterable of (ase.Atoms or StructureRecord, entry) pairs, consumed lazily
+        workers: Number of processes, 1 to write in this process (optional)
+        max_pending: Limit of the structures submitted to the pool at once,
+            4 per worker by default (optional)
+        template: Calc setup template (optional)
+        bundle: Name of a pack file in dir to append all the tasks to,
+            instead of a folder per task (optional)
+
+    Returns:
+        list: Manifest in the order of items, dicts with entry, input, fort34 and error;
+            with a bundle, input and fort34 are None and bundle, name and offset are set
+    """
+    writer = None
+    if bundle:
+        os.makedirs(dir, exist_ok=True)
+        writer = TaskBundleWriter(os.path.join(dir, bundle))
+        write_item = partial(get_pcrystal_task_item, template)
+    else:
+        write_item = partial(write_pcrystal_task_item, dir, template)
+    workers = workers or os.cpu_count() or 1
+
+    def publish(task: dict) -> dict:
+        if writer is None:
+            return task
+        offset = writer.add(task["name"], task["files"])
+        return {
+            "entry": task["entry"],
+            "input": None,
+            "fort34": None,
+            "error": None,
+            "bundle": writer.path,
+            "name": task["name"],
+            "offset": offset,
+        }
+
+    if workers == 1:
+        manifest = []
+        for item in items:
+            try:
+                manifest.append(publish(write_item(item)))
+            except Exception as e:
+                manifest.append(get_failed_task(item[1], e))
+
+    else:
+        max_pending = max_pending or 4 * workers
+        results, pending = {}, {}
+
+        def collect(done):
+            for future in done:
+                n, entry = pending.pop(future)
+                try:
+                    results[n] = publish(future.result())
+                except Exception as e:
+                    results[n] = get_failed_task(entry, e)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for n, item in enumerate(items):
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(write_item, item)] = (n, item[1])
+            collect(wait(pending).done)
+
+        manifest = [results[n] for n in sorted(results)]
+
+    if writer:
+        writer.close()
+
+    failed = sum(1 for task in manifest if task["error"])
+    print(f"Written {len(manifest) - failed} pcrystal tasks to {writer.path if writer else dir}, failed {failed}")
+    return manifest
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+import spglib
+from ase.geometry import cell_to_cellpar
+
+from ab_initio_calculations.settings import Settings
+from ab_initio_calculations.utils.structure_record import as_atoms
+
+
+def get_structure_fingerprint(ase_obj, symprec: float = 1e-3) -> str:
+    """
+    Canonical hash of a crystal structure: the spglib standardized
+    primitive cell, described by rounded cell parameters (0.01 A, 0.1 deg)
+    and by sorted rounded fractional positions (1e-3), independent
+    of the cell setting, orientation, origin, inversion and order of atoms.
+    NB the values are binned by rounding, not compared within a tolerance:
+    two cells differing far less than a rounding step, but on the opposite
+    sides of its boundary, e.g. a = 4.0049 and 4.0051 A, get different hashes
+    """
+    ase_obj = as_atoms(ase_obj)
+    cell = (
+        ase_obj.get_cell().array,
+        ase_obj.get_scaled_positions(),
+        ase_obj.get_atomic_numbers(),
+    )
+    standardized = spglib.standardize_cell(cell, to_primitive=True, symprec=symprec)
+    if standardized is not None:
+        cell = standardized
+    lattice, positions, numbers = cell
+
+    a, b, c, alpha, beta, gamma = cell_to_cellpar(lattice)
+
+    # the origin is not unique, e.g. Na or Cl at 0 in rock salt, and a
+    # noncentrosymmetric cell may come inverted: try every atom of the rarest
+    # species at the origin, with both signs, keep the smallest listing
+    numbers = np.asarray(numbers)
+    counts = np.bincount(numbers)
+    anchor = min(set(numbers.tolist()), key=lambda num: (counts[num], num))
+    sites = None
+    for sign in (1, -1):
+        for origin in positions[numbers == anchor]:
+            shifted = np.round(np.mod(sign * (positions - origin), 1.0), 3) % 1.0 + 0.0
+            listing = sorted((int(num), *pos) for num, pos in zip(numbers, shifted.tolist()))
+            if sites is None or listing < sites:
+                sites = listing
+
+    canonical = ";".join(
+        [f"{a:.2f},{b:.2f},{c:.2f},{alpha:.1f},{beta:.1f},{gamma:.1f}"]
+        + [f"{num}:{x:.3f},{y:.3f},{z:.3f}" for num, x, y, z in sites]
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+TASK_SUBMITTED = "submitted"
+TASK_FINISHED = "finished"
+TASK_FAILED = "failed"
+
+
+class StructureIndex:
+    """
+    Persistent index of the submitted calculations,
+    (fingerprint, engine, template) -> task id, AiiDA PK or UUID, and status;
+    a task is submitted until it is marked finished or failed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                fingerprint TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                template TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                label TEXT,
+                created REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'submitted',
+                PRIMARY KEY (fingerprint, engine, template)
+            )"""
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")]
+        if "status" not in columns:
+            # an index of the earlier versions
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN status TEXT NOT NULL DEFAULT 'submitted'")
+        self.conn.commit()
+
+    def lookup(self, fingerprint: str, engine: str, template: str = "") -> dict:
+        """Return the prior task for the structure, or None"""
+        row = self.conn.execute(
+            "SELECT task_id, label, created, status FROM tasks "
+            "WHERE fingerprint = ? AND engine = ? AND template = ?",
+            (fingerprint, engine, template),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"task_id": row[0], "label": row[1], "created": row[2], "status": row[3]}
+
+    def record(
+        self,
+        fingerprint: str,
+        engine: str,
+        template: str,
+        task_id,
+        label: str = None,
+        status: str = TASK_SUBMITTED,
+    ):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tasks "
+            "(fingerprint, engine, template, task_id, label, created, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint, engine, template, str(task_id), label, time.time(), status),
+        )
+        self.conn.commit()
+
+    def set_status(self, fingerprint: str, engine: str, template: str, status: str):
+        self.conn.execute(
+            "UPDATE tasks SET status = ? WHERE fingerprint = ? AND engine = ? AND template = ?",
+            (status, fingerprint, engine, template),
+        )
+        self.conn.commit()
+
+    def get_submitted(self, engine: str) -> list:
+        """Tasks of the engine not known to be finished or failed yet"""
+        rows = self.conn.execute(
+            "SELECT fingerprint, template, task_id FROM tasks WHERE engine = ? AND status = ?",
+            (engine, TASK_SUBMITTED),
+        ).fetchall()
+        return [{"fingerprint": row[0], "template": row[1], "task_id": row[2]} for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def update_yascheduler_statuses(index: StructureIndex, yac, engine: str):
+    """
+    Mark the submitted tasks yascheduler is done with: failed if the task is
+    unknown or left a CRYSTAL error file (fort.87) in its local folder, finished otherwise
+    """
+    for item in index.get_submitted(engine):
+        task = yac.queue_get_task(int(item["task_id"])) if item["task_id"].isdigit() else None
+        if task is None:
+            status = TASK_FAILED
+        elif task["status"] == yac.STATUS_DONE:
+            folder = (task.get("metadata") or {}).get("local_folder")
+            fort_file = os.path.join(folder, "fort.87") if folder else None
+            failed = fort_file and os.path.exists(fort_file) and os.path.getsize(fort_file)
+            status = TASK_FAILED if failed else TASK_FINISHED
+        else:
+            # still queued or running
+            continue
+        index.set_status(item["fingerprint"], engine, item["template"], status)
+
+
+def get_default_index():
+    """Structure index configured in conf.ini, if any"""
+    try:
+        settings = Settings()
+    except FileNotFoundError:
+        return None
+    if not settings.structure_index:
+        return None
+    return StructureIndex(settings.structure_index)
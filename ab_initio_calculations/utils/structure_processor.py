@@ -1,6 +1,137 @@
 import numpy as np
 from ase import Atoms
-from typing import Union, Tuple
+from typing import Callable, Union, Tuple
+
+
+def get_site_key(line: list) -> tuple:
+    """Raw rows sharing the space group and the nonequivalent positions
+    expand to the same number of sites"""
+    return int(line[3]), tuple(tuple(round(coord, 4) for coord in pos) for pos in line[4])
+
+
+def select_candidate_rows(response: list[list], count_sites: Callable[[list], int]) -> list[int]:
+    """Find the raw rows process_structures may select, before building any structure
+    
+    Args:
+        response: Raw response data from MPDS
+        count_sites: Returns number of sites of the structure built from a row,
+            called once per distinct site key
+        
+    Returns:
+        list: indices of the rows with the fewest sites and of the first row
+            with constant occupancy, in the response order
+    """
+    rows = [idx for idx, line in enumerate(response) if line and line[-1]]
+    if not rows:
+        return []
+
+    n_sites = {}
+    for idx in rows:
+        key = get_site_key(response[idx])
+        if key not in n_sites:
+            n_sites[key] = count_sites(response[idx])
+    row_sites = {idx: n_sites[get_site_key(response[idx])] for idx in rows}
+
+    minimal_sites = min(row_sites.values())
+    selected = {idx for idx in rows if row_sites[idx] == minimal_sites}
+    fully_occupied = next(
+        (idx for idx in rows if all(occ == 1 for occ in response[idx][1])), None
+    )
+    if fully_occupied is not None:
+        selected.add(fully_occupied)
+    return sorted(selected)
+
+
+def get_segment_sums(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Sum values over consecutive segments of the given lengths, empty segments included"""
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    sums = np.concatenate([[0], np.cumsum(values)])
+    return sums[bounds[1:]] - sums[bounds[:-1]]
+
+
+def select_structures_batch(grouped: list[tuple[list[Atoms], list[list], str]]) -> list[dict]:
+    """Select the best candidate for many phases in one pass over stacked arrays,
+    following the same rules as process_structures
+    
+    Args:
+        grouped: (structures, raw response data, key) per phase,
+            as returned by download_structures_batch
+        
+    Returns:
+        list: per phase a dict with the key, index of the selected structure,
+            its entry and number of atoms; index is None if nothing is suitable
+    """
+    table = [{"key": key, "index": None, "entry": None, "n_atoms": None} for _, _, key in grouped]
+
+    phase_ids, n_atoms, cells, occs, n_occs = [], [], [], [], []
+    rows = []
+    for phase, (structs, response, _) in enumerate(grouped):
+        if not structs:
+            continue
+        response = [item for item in response if item != []]
+        for struct, line in zip(structs, response):
+            phase_ids.append(phase)
+            n_atoms.append(len(struct))
+            cells.append(struct.get_cell().reshape(9))
+            occs.extend(line[1])
+            n_occs.append(len(line[1]))
+            rows.append(line)
+    if not rows:
+        return table
+
+    phase_ids = np.array(phase_ids)
+    n_atoms = np.array(n_atoms)
+    cells = np.array(cells)
+    occs = np.array(occs, dtype=float)
+    n_occs = np.array(n_occs)
+    row_idx = np.arange(len(rows))
+    first_row = np.searchsorted(phase_ids, phase_ids)  # rows are grouped by phase
+
+    # minimal number of atoms per phase
+    phases, starts = np.unique(phase_ids, return_index=True)
+    minimal = np.minimum.reduceat(n_atoms, starts)
+    is_minimal = n_atoms == minimal[np.searchsorted(phases, phase_ids)]
+
+    # median cell per phase over the minimal structures:
+    # sort each column within the phase and pick the middle element(s)
+    min_rows = row_idx[is_minimal]
+    min_phases = phase_ids[min_rows]
+    _, min_starts, min_counts = np.unique(min_phases, return_index=True, return_counts=True)
+    lower = min_starts + (min_counts - 1) // 2
+    upper = min_starts + min_counts // 2
+    median_cells = np.empty((len(phases), 9))
+    for col in range(9):
+        column = cells[min_rows, col]
+        column = column[np.lexsort((column, min_phases))]
+        median_cells[:, col] = (column[lower] + column[upper]) / 2
+
+    # minimal structure closest to the median cell, the first one on ties
+    distance = (
+        np.sum((cells[min_rows] - median_cells[np.searchsorted(phases, min_phases)]) ** 2, axis=1)
+        ** 0.5
+    )
+    order = np.lexsort((min_rows, distance, min_phases))
+    median_rows = min_rows[order][min_starts]
+
+    # constant occupancy: the median one has no partial sites,
+    # otherwise the first fully occupied structure of the phase is taken
+    has_partial = get_segment_sums((occs != 1) & (occs != 0), n_occs) > 0
+    not_full = get_segment_sums(occs != 1, n_occs) > 0
+    fallback = np.where(not_full, len(rows), row_idx)
+    fallback_rows = np.minimum.reduceat(fallback, starts)
+
+    for phase, median_row, fallback_row in zip(phases, median_rows, fallback_rows):
+        selected = median_row
+        if has_partial[median_row]:
+            if fallback_row == len(rows):
+                continue
+            selected = fallback_row
+        table[phase].update(
+            index=int(selected - first_row[selected]),
+            entry=rows[selected][0],
+            n_atoms=int(n_atoms[selected]),
+        )
+    return table
 
 
 def process_structures(structs: list[Atoms], response: list[list]) -> Union[Tuple[Atoms, str], Tuple[bool, bool]]:
@@ -16,29 +147,9 @@ def process_structures(structs: list[Atoms], response: list[list]) -> Union[Tupl
     if not structs:
         print("No structures!")
         return False, False
-    
-    # find struct with minimal number of atoms
-    minimal_struct = min([len(s) for s in structs])
-    minimal_structs = [s for s in structs if len(s) == minimal_struct]
-    # find struct with median cell vectors
-    cells = np.array([s.get_cell().reshape(9) for s in minimal_structs])
-    median_cell = np.median(cells, axis=0)
-    median_idx = int(np.argmin(np.sum((cells - median_cell) ** 2, axis=1) ** 0.5))
-    
-    # filter
-    response = [item for item in response if item != []]
-    occs_noneq = [[line[1]] for line in response][median_idx][0]
-    
-    # check: constant occupancy
-    if any([occ for occ in occs_noneq if occ != 1]):
-        for idx, res in enumerate(response):
-            if all([item == 1 for item in res[1]]):
-                entry = [line[:1] for line in response][idx][0]
-                selected_struct = structs[idx]
-                return selected_struct, entry
+
+    selected = select_structures_batch([(structs, response, None)])[0]
+    if selected["index"] is None:
         print("No structures were found where all atoms have constant occupancy!")
         return False, False
-    else:
-        selected_struct = structs[median_idx]
-        entry = [line[:1] for line in response][median_idx][0]
-        return selected_struct, entry
\ No newline at end of file
+    return structs[selected["index"]], selected["entry"]
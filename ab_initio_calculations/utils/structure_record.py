@@ -0,0 +1,75 @@
+import numpy as np
+from ase import Atoms
+from ase.data import chemical_symbols
+from ase.symbols import Symbols
+
+
+class StructureRecord:
+    """Compact crystal structure for holding many phases at once.
+    Cell vectors and fractional positions share a single float array,
+    atomic numbers are kept as bytes; an ase.Atoms is only built
+    by to_atoms() when a structure reaches an engine input writer.
+    """
+
+    __slots__ = ("_data", "_numbers", "entry", "sg")
+
+    def __init__(self, cell, positions, numbers, entry: str = None, sg: int = None):
+        self._data = np.concatenate(
+            [np.asarray(cell, dtype=float).reshape(3, 3), np.asarray(positions, dtype=float)]
+        )
+        self._numbers = np.asarray(numbers, dtype=np.uint8).tobytes()
+        self.entry = entry
+        self.sg = sg
+
+    @classmethod
+    def from_atoms(cls, atoms: Atoms, entry: str = None, sg: int = None) -> "StructureRecord":
+        return cls(
+            atoms.get_cell().array,
+            atoms.get_scaled_positions(wrap=False),
+            atoms.get_atomic_numbers(),
+            entry=entry,
+            sg=sg,
+        )
+
+    def to_atoms(self) -> Atoms:
+        return Atoms(
+            numbers=self.numbers,
+            cell=self.cell,
+            scaled_positions=self.positions,
+            pbc=True,
+        )
+
+    @property
+    def cell(self) -> np.ndarray:
+        return self._data[:3]
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Fractional coordinates"""
+        return self._data[3:]
+
+    @property
+    def numbers(self) -> np.ndarray:
+        return np.frombuffer(self._numbers, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __repr__(self):
+        return f"StructureRecord({self.get_chemical_formula()}, entry={self.entry}, sg={self.sg})"
+
+    def get_cell(self) -> np.ndarray:
+        return self.cell
+
+    def get_chemical_symbols(self) -> list[str]:
+        return [chemical_symbols[num] for num in self._numbers]
+
+    def get_chemical_formula(self, mode: str = "hill") -> str:
+        return Symbols(self.numbers).get_chemical_formula(mode)
+
+
+def as_atoms(struct) -> Atoms:
+    """Pass ase.Atoms through, expand StructureRecord"""
+    if isinstance(struct, StructureRecord):
+        return struct.to_atoms()
+    return struct
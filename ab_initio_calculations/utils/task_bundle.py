@@ -0,0 +1,97 @@
+import json
+import os
+import struct
+import zlib
+
+# every record is its length followed by the zlib-compressed JSON
+# {"name": ..., "files": {file name: content}}
+RECORD_HEADER = struct.Struct(">I")
+
+
+def get_index_path(path: str) -> str:
+    return path + ".index.jsonl"
+
+
+class TaskBundleWriter:
+    """
+    Append-only pack file of many tasks, with a JSONL index of
+    name, offset and length; an index line is written only after its record
+    """
+
+    def __init__(self, path: str, level: int = 6):
+        self.path = path
+        self.level = level
+        self.pack = open(path, "ab")
+        self.index = open(get_index_path(path), "a")
+
+    def add(self, name: str, files: dict) -> int:
+        """Append a task, return its offset"""
+        record = zlib.compress(
+            json.dumps({"name": name, "files": files}).encode("utf-8"), self.level
+        )
+        offset = self.pack.tell()
+        self.pack.write(RECORD_HEADER.pack(len(record)) + record)
+        self.pack.flush()
+        self.index.write(json.dumps({"name": name, "offset": offset, "length": len(record)}) + "\n")
+        return offset
+
+    def close(self):
+        for f in (self.pack, self.index):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TaskBundleReader:
+    """Sequential or by-name reading of a task pack file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = None
+
+    def __iter__(self):
+        return self.read()
+
+    def read(self, start: int = 0):
+        """Stream (name, files) of the tasks in the order they were added, from the offset"""
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                (length,) = RECORD_HEADER.unpack(header)
+                record = f.read(length)
+                if len(record) < length:
+                    # an interrupted append
+                    break
+                task = json.loads(zlib.decompress(record))
+                yield task["name"], task["files"]
+
+    def get_index(self) -> dict:
+        if self._index is None:
+            self._index = {}
+            index_path = get_index_path(self.path)
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    for line in f:
+                        if line.strip():
+                            item = json.loads(line)
+                            self._index[item["name"]] = item
+        return self._index
+
+    def get(self, name: str) -> dict:
+        """Files of a single task"""
+        item = self.get_index()[name]
+        with open(self.path, "rb") as f:
+            f.seek(item["offset"] + RECORD_HEADER.size)
+            return json.loads(zlib.decompress(f.read(item["length"])))["files"]
+
+    def __len__(self):
+        return len(self.get_index())
@@ -0,0 +1,78 @@
+"""
+Scaling of compile_crystal over a large response with the number of processes.
+
+Usage:
+    python benchmark_compile_crystal.py            # 5000 synthetic binary rows
+    python benchmark_compile_crystal.py 20000      # custom number of rows
+    python benchmark_compile_crystal.py 0 '{"classes": "binary", "sgs": 225}'   # real MPDS query
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+from ab_initio_calculations.mpds.receiver import (
+    STRUCT_FIELDS,
+    compile_rows,
+    get_data,
+    get_default_cache,
+)
+from mpds_client import MPDSDataRetrieval, MPDSDataTypes
+
+# rock salt, CsCl, zinc blende, fluorite, perovskite-like
+PROTOTYPES = [
+    (225, [[0, 0, 0], [0.5, 0.5, 0.5]], ["Na", "Cl"]),
+    (221, [[0, 0, 0], [0.5, 0.5, 0.5]], ["Cs", "Cl"]),
+    (216, [[0, 0, 0], [0.25, 0.25, 0.25]], ["Zn", "S"]),
+    (225, [[0, 0, 0], [0.25, 0.25, 0.25]], ["Ca", "F"]),
+    (221, [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0.5, 0]], ["Ba", "Ti", "O"]),
+]
+
+
+def get_synthetic_response(n_rows: int) -> list[list]:
+    response = []
+    for i in range(n_rows):
+        sg_n, basis, els = random.choice(PROTOTYPES)
+        a = random.uniform(3.5, 6.5)
+        response.append(
+            [f"S{i}", [1] * len(basis), [a, a, a, 90, 90, 90], sg_n, basis, els]
+        )
+    return response
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    if len(sys.argv) > 2:
+        client = MPDSDataRetrieval(dtype=MPDSDataTypes.ALL)
+        query = {"props": "atomic structure", **json.loads(sys.argv[2])}
+        response = get_data(client, query, STRUCT_FIELDS, get_default_cache())
+    else:
+        random.seed(0)
+        response = get_synthetic_response(n_rows)
+
+    print(f"{len(response)} rows, {os.cpu_count()} cores")
+    reference = None
+    workers = 1
+    while workers <= os.cpu_count():
+        start = time.perf_counter()
+        structs = compile_rows(response, workers)
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = elapsed
+            serial = structs
+        assert [len(s) if s else 0 for s in structs] == [
+            len(s) if s else 0 for s in serial
+        ], "Order of the structures differs from the serial run"
+
+        print(
+            f"workers={workers:<3} {elapsed:8.2f} s  "
+            f"{len(response) / elapsed:8.0f} rows/s  speedup {reference / elapsed:.2f}"
+        )
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Throughput of the D12 input generation: a full D12 render per structure
+against the cached deck with the cached basis block spliced in.
+
+Usage:
+    python benchmark_d12.py            # 2000 inputs over random binaries and ternaries
+    python benchmark_d12.py 10000      # custom number of inputs
+"""
+
+import random
+import sys
+import time
+
+from aiida_crystal_dft.io.d12 import D12
+
+from ab_initio_calculations.utils.pcrystal_utils import (
+    DEFAULT_TEMPLATE,
+    Pcrystal_setup,
+    get_calc_params,
+    get_tolerance_rule,
+    render_d12,
+    set_d12_label,
+    thaw,
+)
+
+
+def get_combinations(n_inputs: int, els: list) -> list[tuple]:
+    # a sweep over the phases, where the same element sets recur
+    pool = [tuple(sorted(random.sample(els, random.choice([2, 3])))) for _ in range(n_inputs // 10 or 1)]
+    return [random.choice(pool) for _ in range(n_inputs)]
+
+
+def render_uncached(combination: tuple, label: str) -> str:
+    rule = get_tolerance_rule(combination)
+    params = thaw(get_calc_params(DEFAULT_TEMPLATE, rule.name if rule else None)["crystal"])
+    params["label"] = label
+    return str(D12(parameters=params, basis=[Pcrystal_setup.els_repo[el] for el in combination]))
+
+
+def render_cached(combination: tuple, label: str) -> str:
+    rule = get_tolerance_rule(combination)
+    return set_d12_label(render_d12(DEFAULT_TEMPLATE, rule.name if rule else None, combination), label)
+
+
+def main():
+    n_inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    random.seed(0)
+    combinations = get_combinations(n_inputs, list(Pcrystal_setup.els_repo))
+
+    # load the basis sets outside of the timing
+    for combination in set(combinations):
+        for el in combination:
+            Pcrystal_setup.els_repo[el]
+
+    for name, render in (("D12 per structure", render_uncached), ("cached blocks", render_cached)):
+        start = time.perf_counter()
+        for n, combination in enumerate(combinations):
+            render(combination, f"test S{n}")
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20} {elapsed:8.2f} s  {n_inputs / elapsed:10.0f} inputs/s")
+
+    for n, combination in enumerate(combinations[:200]):
+        assert render_cached(combination, f"test S{n}") == render_uncached(combination, f"test S{n}"), combination
+    print("Cached inputs are identical to the full D12 render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Regression and throughput check of the vectorized fort.34 writer
+against Fort34 of aiida_crystal_dft, which it must reproduce byte by byte.
+
+Usage:
+    python benchmark_fort34.py          # prototypes, supercells up to 4x4x4, distorted cells
+    python benchmark_fort34.py 6        # supercells up to 6x6x6
+"""
+
+import sys
+import time
+
+import numpy as np
+from aiida_crystal_dft.io.f34 import Fort34
+from ase.build import bulk
+from ase.data import atomic_numbers
+
+from ab_initio_calculations.utils.basis_registry import verbatim_basis
+from ab_initio_calculations.utils.fort34 import get_fort34
+
+# the ECP flag is the only part of the basis Fort34 looks at
+ECP_ELEMENTS = {"Hg": 280, "Ba": 256, "Sr": 238}
+
+
+def get_basis(els: set) -> list:
+    return [
+        verbatim_basis(content=f"{ECP_ELEMENTS[el]} 1", all_electron=False)
+        if el in ECP_ELEMENTS
+        else verbatim_basis(content=f"{atomic_numbers[el]} 1", all_electron=True)
+        for el in els
+    ]
+
+
+def get_structures(max_repeat: int) -> list:
+    prototypes = [
+        bulk("NaCl", "rocksalt", a=5.64),
+        bulk("ZnS", "zincblende", a=5.41),
+        bulk("Cu", "fcc", a=3.61),
+        bulk("Fe", "bcc", a=2.87),
+        bulk("Mg", "hcp", a=3.21, c=5.21),
+        bulk("Si", "diamond", a=5.43),
+        bulk("HgTe", "zincblende", a=6.46),
+        bulk("BaO", "rocksalt", a=5.52),
+        bulk("Sr", "fcc", a=6.08),
+    ]
+    structures = list(prototypes)
+    for repeat in range(2, max_repeat + 1):
+        structures += [proto.repeat(repeat) for proto in prototypes[:4]]
+
+    rng = np.random.default_rng(0)
+    for proto in prototypes:
+        distorted = proto.repeat(2)
+        distorted.rattle(0.05, rng=rng)
+        structures.append(distorted)
+    return structures
+
+
+def main():
+    max_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    structures = get_structures(max_repeat)
+
+    for ase_obj in structures:
+        els = set(ase_obj.get_chemical_symbols())
+        reference = str(Fort34(get_basis(els)).from_ase(ase_obj))
+        ecp_numbers = [atomic_numbers[el] for el in els if el in ECP_ELEMENTS]
+        assert get_fort34(ase_obj, ecp_numbers) == reference, ase_obj.get_chemical_formula()
+    print(f"{len(structures)} structures, output is identical to Fort34")
+
+    def write_fort34(ase_obj):
+        return str(Fort34(get_basis(set(ase_obj.get_chemical_symbols()))).from_ase(ase_obj))
+
+    for name, write in (("Fort34", write_fort34), ("get_fort34", get_fort34)):
+        start = time.perf_counter()
+        n_atoms = 0
+        for ase_obj in structures:
+            write(ase_obj)
+            n_atoms += len(ase_obj)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} {elapsed:8.3f} s  {len(structures) / elapsed:8.0f} structures/s  {n_atoms / elapsed:10.0f} atoms/s")
+
+
+if __name__ == "__main__":
+    main()
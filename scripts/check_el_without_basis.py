@@ -1,22 +1,13 @@
-import os
-
 import periodictable
 
-from ab_initio_calculations.settings import Settings
+from ab_initio_calculations.utils.basis_registry import get_basis_registry
 
 if __name__ == "__main__":
-    dir = Settings().basis_sets_dir
-
-    files = [
-        f.replace(".basis", "")
-        for f in os.listdir(
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), dir)
-        )
-    ]
+    registry = get_basis_registry()
 
     els_no_basis = []
     for element in periodictable.elements:
-        if element.symbol not in files:
+        if element.symbol not in registry:
             els_no_basis.append(element)
 
     print(els_no_basis)
@@ -2,20 +2,20 @@ import os
 import time
 from pathlib import Path
 
-from ab_initio_calculations.utils.fleur_utils import convert_inp_to_xml
+from ab_initio_calculations.utils.fleur_utils import convert_inp_batch
 from yascheduler import Yascheduler
 
 yac = Yascheduler()
 
 
-def run_by_yascheduler_from_inp_file(inp_file: Path):
+def run_by_yascheduler_from_inp_file(inp_file: Path, converted):
     """
-    Convert .inp to .xml, then submit to Yascheduler.
+    Submit the .inp file converted to .xml to Yascheduler.
     """
-    _, xml_content = convert_inp_to_xml(inp_file)
-    if xml_content is None:
+    if converted is None:
         print(f"[ERROR] Failed to convert {inp_file.name} to XML.")
         return
+    _, xml_content = converted
 
     task_name = inp_file.stem
 
@@ -28,7 +28,7 @@ def run_by_yascheduler_from_inp_file(inp_file: Path):
     print(f"Task for {task_name} submitted with ID: {submit_result}")
 
 
-def main(inp_dir: Path):
+def main(input_dir: Path):
     if not input_dir.exists() or not input_dir.is_dir():
         print(f"Directory {input_dir} does not exist or is not a directory")
         return
@@ -38,10 +38,15 @@ def main(inp_dir: Path):
         print(f"No .inp files found in {input_dir}")
         return
 
-    for inp_file in inp_files:
+    # all the conversions go at once, inpgen of each in its own scratch folder
+    start_time = time.time()
+    converted_files = convert_inp_batch(inp_files)
+    print(f"Elapsed time for converting {len(inp_files)} files: {time.time() - start_time:.2f} seconds")
+
+    for inp_file, converted in zip(inp_files, converted_files):
         start_time = time.time()
         try:
-            run_by_yascheduler_from_inp_file(inp_file)
+            run_by_yascheduler_from_inp_file(inp_file, converted)
         except Exception as e:
             print(f"Error processing {inp_file.name}: {e}")
         end_time = time.time()
@@ -56,5 +61,5 @@ if __name__ == "__main__":
     
     load_dotenv(CONFIG_PATH)
     
-    input_dir = os.environ['FLEUR_INP_DIR']
+    input_dir = Path(os.environ['FLEUR_INP_DIR'])
     main(input_dir)
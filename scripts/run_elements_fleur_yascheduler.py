@@ -6,6 +6,12 @@ from ab_initio_calculations.settings import Settings
 from ab_initio_calculations.utils.chemical_utils import \
     get_list_of_basis_elements
 from ab_initio_calculations.utils.fleur_utils import Fleur_setup
+from ab_initio_calculations.utils.structure_index import (
+    TASK_FAILED,
+    get_default_index,
+    get_structure_fingerprint,
+    update_yascheduler_statuses,
+)
 from ab_initio_calculations.utils.structure_processor import process_structures
 from yascheduler import Yascheduler
 
@@ -14,6 +20,7 @@ os.environ['FLEUR_INPGEN_PATH'] = "/root/fleur/build/inpgen"
 
 settings = Settings()
 yac = Yascheduler()
+index = get_default_index()
 
 
 def run_by_yascheduler(el: str):
@@ -24,9 +31,17 @@ def run_by_yascheduler(el: str):
         return
     atoms_obj, _ = process_structures(structs, response)
 
-    if atoms_obj is None:
+    if not atoms_obj:
         return
 
+    if index:
+        fingerprint = get_structure_fingerprint(atoms_obj)
+        prior = index.lookup(fingerprint, "fleur")
+        # the failed tasks are submitted again
+        if prior and prior["status"] != TASK_FAILED:
+            print(f"[INFO] {el} is already {prior['status']} as task {prior['task_id']}")
+            return
+
     setup = Fleur_setup(atoms_obj)
     error = setup.validate()
 
@@ -44,9 +59,13 @@ def run_by_yascheduler(el: str):
         "fleur",
     )
     print(f"Task for {el} submitted with ID: {result}")
+    if index:
+        index.record(fingerprint, "fleur", "", result, str(atoms_obj.symbols))
 
 def main():
     """Main function to run the script for all elements."""
+    if index:
+        update_yascheduler_statuses(index, yac, "fleur")
     for el in get_list_of_basis_elements():
         start_time = time.time()
         run_by_yascheduler(el)
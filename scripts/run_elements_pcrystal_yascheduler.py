@@ -3,14 +3,25 @@ import os
 from mpds_client import APIError
 
 
-from ab_initio_calculations.utils.pcrystal_utils import convert_to_pcrystal_input
-from ab_initio_calculations.mpds.receiver import download_structures
+from ab_initio_calculations.utils.pcrystal_utils import generate_pcrystal_inputs
+from ab_initio_calculations.mpds.receiver import download_structures_batch
 from ab_initio_calculations.utils.chemical_utils import (
     get_list_of_basis_elements,
 )
+from ab_initio_calculations.utils.structure_index import (
+    TASK_FAILED,
+    get_default_index,
+    get_structure_fingerprint,
+    update_yascheduler_statuses,
+)
 from ab_initio_calculations.utils.structure_processor import process_structures
+from ab_initio_calculations.utils.task_bundle import TaskBundleReader
 from yascheduler import Yascheduler
 
+TEMPLATE = "pcrystal_demo.yml"
+# write all the tasks into one pack file instead of a folder per task
+BUNDLE = os.getenv("PCRYSTAL_BUNDLE")
+
 
 def submit_yascheduler_task(input_file):
     """Give task to yascheduler"""
@@ -43,28 +54,83 @@ def submit_yascheduler_task(input_file):
     )
     print(label)
     print(result)
-    
+    return result
+
+
+def submit_yascheduler_bundle(bundle_path, start=0):
+    """Give the tasks of a pack file to yascheduler in one sequential read"""
+    results_folder = os.path.dirname(os.path.abspath(bundle_path))
+    yac = Yascheduler()
+    task_ids = {}
+
+    for name, files in TaskBundleReader(bundle_path).read(start):
+        assert "EXTERNAL" in files["INPUT"]
+        work_folder = os.path.join(results_folder, name)
+        os.makedirs(work_folder, exist_ok=True)
+
+        label = files["INPUT"].splitlines()[0]
+        task_ids[name] = yac.queue_submit_task(
+            label,
+            {"fort.34": files["fort.34"], "INPUT": files["INPUT"], "local_folder": work_folder},
+            "pcrystal",
+        )
+        print(label)
+        print(task_ids[name])
+
+    return task_ids
+
+
 def main():
     pcrystal_task_dir = "./pcrystal_tasks_yascheduler"
-    for el in get_list_of_basis_elements():
+    index = get_default_index()
+    if index:
+        update_yascheduler_statuses(index, Yascheduler(), "pcrystal")
+
+    items, fingerprints = [], []
+    for structs, response, el in download_structures_batch(get_list_of_basis_elements()):
         try:
-            structs, response, el = download_structures(el)
             if structs is None:
                 print(f"[WARNING] Skipping element {el} due to missing data.")
                 continue
             atoms_obj, _ = process_structures(structs, response)
 
-            if atoms_obj is None:
+            if not atoms_obj:
                 continue
-            if atoms_obj:
-                task_path = convert_to_pcrystal_input(
-                    pcrystal_task_dir, [atoms_obj], 'test_' + el
-                )
-                submit_yascheduler_task(task_path)
+
+            fingerprint = None
+            if index:
+                fingerprint = get_structure_fingerprint(atoms_obj)
+                prior = index.lookup(fingerprint, "pcrystal", TEMPLATE)
+                # the failed tasks are submitted again
+                if prior and prior["status"] != TASK_FAILED:
+                    print(f"[INFO] {el} is already {prior['status']} as task {prior['task_id']}")
+                    continue
+
+            items.append((atoms_obj, 'test_' + el))
+            fingerprints.append(fingerprint)
         except APIError as ex:
             if ex.code == 204:
                 pass
 
+    manifest = generate_pcrystal_inputs(pcrystal_task_dir, items, template=TEMPLATE, bundle=BUNDLE)
+    task_ids = {}
+    if BUNDLE:
+        # only the bundled tasks have the offsets, those of this run are at the end of the pack file
+        offsets = [task["offset"] for task in manifest if not task["error"]]
+        if offsets:
+            task_ids = submit_yascheduler_bundle(os.path.join(pcrystal_task_dir, BUNDLE), min(offsets))
+
+    for task, fingerprint in zip(manifest, fingerprints):
+        if task["error"]:
+            print(f"[ERROR] {task['entry']}: {task['error']}")
+            continue
+        if BUNDLE:
+            task_id = task_ids.get(task["name"])
+        else:
+            task_id = submit_yascheduler_task(task["input"])
+        if index:
+            index.record(fingerprint, "pcrystal", TEMPLATE, task_id, task["entry"])
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -24,6 +24,13 @@ from aiida.engine import submit
 
 from mpds_aiida.workflows.fleur_seebeck import FleurDOSLocalWorkChain, DEFAULT_SEEBECK
 
+from ab_initio_calculations.mpds.receiver import STRUCT_FIELDS, compile_structures
+from ab_initio_calculations.utils.structure_index import (
+    get_default_index,
+    get_structure_fingerprint,
+)
+from ab_initio_calculations.utils.structure_processor import process_structures
+
 load_profile()
 
 MPDS_KEY = "KEY_HERE"
@@ -38,7 +45,7 @@ def fetch_structure_from_mpds(formula, sg, max_retries=3):
         try:
             answer = client.get_data(
                 {"formulae": formula, "sgs": sg, "props": "atomic structure"},
-                fields={"S": ["cell_abc", "sg_n", "basis_noneq", "els_noneq"]},
+                fields=STRUCT_FIELDS,
             )
             break
         except Exception as e:
@@ -49,18 +56,13 @@ def fetch_structure_from_mpds(formula, sg, max_retries=3):
     if not answer:
         raise ValueError(f"No structure found for {formula}/{sg}")
 
-    structs = [client.compile_crystal(line, flavor="ase") for line in answer]
-    structs = list(filter(None, structs))
+    structs, answer = compile_structures(answer)
     if not structs:
         raise ValueError(f"No valid structures for {formula}/{sg}")
 
-    import numpy as np
-    minimal_struct = min(len(s) for s in structs)
-    candidates = [s for s in structs if len(s) == minimal_struct]
-    cells = np.array([s.get_cell().reshape(9) for s in candidates])
-    median_cell = np.median(cells, axis=0)
-    median_idx = int(np.argmin(np.linalg.norm(cells - median_cell, axis=1)))
-    ase_struct = candidates[median_idx]
+    ase_struct, _ = process_structures(structs, answer)
+    if not ase_struct:
+        raise ValueError(f"No structures with constant occupancy for {formula}/{sg}")
 
     return StructureData(ase=ase_struct)
 
@@ -76,6 +78,7 @@ if len(sys.argv) > 1:
     phases = [(arg[0], int(arg[1]))]
 
 results = []
+index = get_default_index()
 
 for formula, sg in phases:
     print(f"\n{'='*60}")
@@ -83,10 +86,23 @@ for formula, sg in phases:
 
     try:
         structure = fetch_structure_from_mpds(formula, sg)
+    except Exception as e:
+        print(f"  [ERROR] Failed to fetch structure for {formula}/{sg}: {e}")
+        results.append((formula, sg, "-", "-", "errored_structure"))
+        continue
+
+    fingerprint = get_structure_fingerprint(structure.get_ase())
+    prior = index.lookup(fingerprint, "fleur_seebeck", f"T={TEMPERATURE}") if index else None
+    if prior:
+        print(f"  [SKIP] Already submitted as PK={prior['task_id']}")
+        results.append((formula, sg, "-", prior["task_id"], "already_submitted"))
+        continue
+
+    try:
         structure.store()
         print(f"  Structure stored: PK={structure.pk}")
     except Exception as e:
-        print(f"  [ERROR] Failed to fetch structure for {formula}/{sg}: {e}")
+        print(f"  [ERROR] Failed to store structure for {formula}/{sg}: {e}")
         results.append((formula, sg, "-", "-", "errored_structure"))
         continue
 
@@ -130,6 +146,10 @@ for formula, sg in phases:
         workchain = submit(FleurDOSLocalWorkChain, **inputs)
         print(f"  [OK] Submitted FleurDOSLocalWorkChain PK={workchain.pk} T={TEMPERATURE}K")
         results.append((formula, sg, structure.pk, workchain.pk, "submitted"))
+        if index:
+            index.record(
+                fingerprint, "fleur_seebeck", f"T={TEMPERATURE}", workchain.pk, f"{formula}/{sg}"
+            )
     except Exception as e:
         print(f"  [ERROR] Submission failed: {e}")
         results.append((formula, sg, structure.pk, "-", "errored_submit"))